@@ -1,12 +1,29 @@
 # app.py
 
-from datetime import date
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import islice
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
-
+import re
+import secrets
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+import numpy as np
 import pandas as pd
-from psycopg2.extras import execute_values
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 
@@ -20,10 +37,15 @@ from flask import (
     session,
     flash,
     jsonify,
+    g,
+    has_app_context,
 )
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 import bcrypt
+import click
 
 # Importa aquí tu función para conectar a la BD (debe devolver psycopg2 connection)
 from db_config import conectar_db
@@ -32,83 +54,913 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "clave_super_segura")
 
 
+# -----------------------------
+# Pool de conexiones
+# -----------------------------
+# Tamaño del pool por proceso (cada worker de gunicorn/uwsgi tiene el suyo)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+# Segundos máximos esperando una conexión libre cuando el pool está lleno
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Una conexión ociosa más de estos segundos se verifica con SELECT 1 antes de prestarla
+DB_POOL_CHECK_IDLE = float(os.environ.get("DB_POOL_CHECK_IDLE", "30"))
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones psycopg2 seguro para hilos.
+    Usa conectar_db() como fábrica, así las credenciales siguen viviendo solo en db_config.py.
+    """
+
+    def __init__(self, minimo: int, maximo: int, timeout: float, verificar_ociosa: float):
+        self.minimo = max(0, minimo)
+        self.maximo = max(1, maximo, self.minimo)
+        self.timeout = timeout
+        self.verificar_ociosa = verificar_ociosa
+        self._libres = []  # [(conn, momento_devolucion)]
+        self._en_uso = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "creadas": 0,
+            "cerradas": 0,
+            "prestamos": 0,
+            "esperas": 0,
+            "timeouts": 0,
+            "descartadas": 0,
+        }
+        for _ in range(self.minimo):
+            self._libres.append((self._crear(), time.monotonic()))
+
+    def _crear(self):
+        conn = conectar_db()
+        with self._cond:
+            self._stats["creadas"] += 1
+        return conn
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["cerradas"] += 1
+
+    def _sana(self, conn, ociosa: float) -> bool:
+        """Health check: descarta conexiones cerradas y hace ping a las que llevan tiempo ociosas."""
+        if conn.closed:
+            return False
+        if ociosa < self.verificar_ociosa:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def obtener(self):
+        limite = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._libres:
+                    conn, devuelta = self._libres.pop()
+                    break
+                if self._en_uso + len(self._libres) < self.maximo:
+                    conn, devuelta = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats["timeouts"] += 1
+                    raise psycopg2.pool.PoolError("Pool de conexiones agotado")
+                self._stats["esperas"] += 1
+                self._cond.wait(restante)
+            # Reservamos el cupo antes de soltar el lock
+            self._en_uso += 1
+            self._stats["prestamos"] += 1
+
+        try:
+            if conn is not None and not self._sana(conn, time.monotonic() - devuelta):
+                with self._cond:
+                    self._stats["descartadas"] += 1
+                self._cerrar(conn)
+                conn = None
+            if conn is None:
+                conn = self._crear()
+            return conn
+        except Exception:
+            with self._cond:
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+
+    def devolver(self, conn, descartar: bool = False):
+        if not descartar and not conn.closed:
+            try:
+                # Nunca devolvemos una conexión con una transacción abierta o abortada
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                descartar = True
+
+        cerrar = descartar or conn.closed
+        with self._cond:
+            self._en_uso -= 1
+            if cerrar:
+                self._stats["descartadas"] += 1
+            else:
+                self._libres.append((conn, time.monotonic()))
+            self._cond.notify()
+        if cerrar:
+            self._cerrar(conn)
+
+    @contextmanager
+    def conexion(self):
+        conn = self.obtener()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+
+    def verificar(self) -> int:
+        """Hace ping a todas las conexiones libres y descarta las caídas. Devuelve cuántas se descartaron."""
+        with self._cond:
+            libres, self._libres = self._libres, []
+            self._en_uso += len(libres)
+        malas = 0
+        for conn, _ in libres:
+            sana = self._sana(conn, self.verificar_ociosa)
+            malas += 0 if sana else 1
+            self.devolver(conn, descartar=not sana)
+        return malas
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "min": self.minimo,
+                "max": self.maximo,
+                "en_uso": self._en_uso,
+                "libres": len(self._libres),
+                **self._stats,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool() -> PoolConexiones:
+    """Crea el pool una sola vez por proceso (se recrea tras un fork, sin tocar las conexiones del padre)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = PoolConexiones(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE)
+                _pool_pid = pid
+    return _pool
+
+
+def conexion_db():
+    """Context manager: presta una conexión del pool y la devuelve al salir."""
+    return obtener_pool().conexion()
+
+
 # -----------------------------
 # Utilidades de base de datos
 # -----------------------------
-def query_uno(sql: str, params: tuple = None):
-    conn = conectar_db()
+def snapshot_lectura(vista):
+    """
+    Decorador para vistas de solo lectura: todas las query_* del request comparten
+    una conexión del pool y una misma transacción REPEATABLE READ READ ONLY.
+    La conexión se pide de forma perezosa (en la primera consulta) y se devuelve al terminar la vista.
+    """
+    @wraps(vista)
+    def wrapper(*args, **kwargs):
+        if g.get("db_snapshot_activo"):
+            return vista(*args, **kwargs)
+        g.db_snapshot_activo = True
+        try:
+            return vista(*args, **kwargs)
+        finally:
+            g.db_snapshot_activo = False
+            conn = g.pop("db_snapshot", None)
+            if conn is not None:
+                obtener_pool().devolver(conn)
+    return wrapper
+
+
+@contextmanager
+def _conexion_lectura():
+    """Conexión del snapshot del request si hay uno activo; si no, una prestada del pool."""
+    if not (has_app_context() and g.get("db_snapshot_activo")):
+        with conexion_db() as conn:
+            yield conn
+        return
+
+    conn = g.get("db_snapshot")
+    if conn is None:
+        conn = g.db_snapshot = obtener_pool().obtener()
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
     try:
+        yield conn
+    except Exception:
+        # Una consulta fallida aborta la transacción: la siguiente abre un snapshot nuevo
+        conn.rollback()
+        raise
+
+
+def query_uno(sql: str, params: tuple = None):
+    with _conexion_lectura() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             cur.execute(sql, params or ())
             return cur.fetchone()
-    finally:
-        conn.close()
 
 
 def query_todos(sql: str, params: tuple = None):
-    conn = conectar_db()
-    try:
+    with _conexion_lectura() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             cur.execute(sql, params or ())
             return cur.fetchall()
-    finally:
-        conn.close()
 
 
 def query_valor(sql: str, params: tuple = None):
-    conn = conectar_db()
-    try:
+    with _conexion_lectura() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             fila = cur.fetchone()
             return fila[0] if fila else None
-    finally:
-        conn.close()
+
+
+def query_lote(consultas: list) -> list:
+    """
+    Ejecuta varias consultas de lectura en un solo viaje de red.
+    consultas: lista de (modo, sql, params) con modo 'uno' | 'todos' | 'valor'.
+    Devuelve los resultados en el mismo orden, con la forma de query_uno/query_todos/query_valor.
+    Ojo: 'uno' y 'todos' viajan como JSON, así que las fechas llegan como texto ISO
+    (los numeric se conservan como Decimal).
+    """
+    columnas = []
+    params = []
+    for i, (modo, sql, p) in enumerate(consultas):
+        sql = sql.strip().rstrip(";")
+        if modo == "valor":
+            columnas.append(f"(SELECT * FROM ({sql}) q LIMIT 1) AS r{i}")
+        elif modo == "uno":
+            columnas.append(f"(SELECT row_to_json(q) FROM ({sql}) q LIMIT 1) AS r{i}")
+        elif modo == "todos":
+            columnas.append(f"(SELECT COALESCE(json_agg(q), '[]'::json) FROM ({sql}) q) AS r{i}")
+        else:
+            raise ValueError(f"Modo de consulta desconocido: {modo}")
+        params.extend(p or ())
+
+    with _conexion_lectura() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.register_default_json(cur, loads=partial(json.loads, parse_float=Decimal))
+            cur.execute("SELECT\n" + ",\n".join(columnas), tuple(params))
+            return list(cur.fetchone())
+
+
+# Hilos para lanzar consultas independientes en paralelo (cada una con su conexión del pool)
+DB_PARALELO_MAX = int(os.environ.get("DB_PARALELO_MAX", str(min(8, DB_POOL_MAX))))
+
+_ejecutor = None
+_ejecutor_pid = None
+_ejecutor_lock = threading.Lock()
+
+
+def obtener_ejecutor() -> ThreadPoolExecutor:
+    """Pool de hilos para consultas, uno por proceso (como el pool de conexiones)."""
+    global _ejecutor, _ejecutor_pid
+    pid = os.getpid()
+    if _ejecutor is None or _ejecutor_pid != pid:
+        with _ejecutor_lock:
+            if _ejecutor is None or _ejecutor_pid != pid:
+                _ejecutor = ThreadPoolExecutor(max_workers=DB_PARALELO_MAX, thread_name_prefix="db")
+                _ejecutor_pid = pid
+    return _ejecutor
+
+
+_QUERY_POR_MODO = {"uno": query_uno, "todos": query_todos, "valor": query_valor}
+
+
+def query_paralelo(consultas: dict) -> dict:
+    """
+    Ejecuta consultas independientes en paralelo y espera a todas.
+    consultas: {nombre: (modo, sql, params)} con modo 'uno' | 'todos' | 'valor'.
+    Devuelve {nombre: resultado}. La latencia total es la de la consulta más lenta.
+    Las consultas corren fuera del snapshot del request (cada hilo usa su propia conexión).
+    """
+    if len(consultas) <= 1:
+        return {k: _QUERY_POR_MODO[modo](sql, params) for k, (modo, sql, params) in consultas.items()}
+    ejecutor = obtener_ejecutor()
+    futuros = {
+        k: ejecutor.submit(_QUERY_POR_MODO[modo], sql, params)
+        for k, (modo, sql, params) in consultas.items()
+    }
+    return {k: f.result() for k, f in futuros.items()}
 
 
 def exec_sql(sql: str, params: tuple = None) -> bool:
-    conn = conectar_db()
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params or ())
-        return True
-    except Exception as e:
-        # En producción loggear
-        print("DB error:", e)
-        return False
-    finally:
-        conn.close()
+    with conexion_db() as conn:
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params or ())
+            return True
+        except Exception as e:
+            # En producción loggear
+            print("DB error:", e)
+            return False
 
 def exec_sql_returning(sql: str, params: tuple = None):
     """
     Ejecuta SQL y retorna (ok, value) donde value es la primera columna del RETURNING si existe.
     """
-    conn = conectar_db()
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params or ())
-                value = None
-                try:
-                    row = cur.fetchone()
-                    if row:
-                        value = row[0]
-                except Exception:
-                    value = None
-        return True, value
-    except Exception as e:
-        print("DB error:", e)
+    with conexion_db() as conn:
         try:
-            conn.rollback()
-        except Exception:
-            pass
-        return False, None
-    finally:
-        conn.close()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params or ())
+                    value = None
+                    try:
+                        row = cur.fetchone()
+                        if row:
+                            value = row[0]
+                    except Exception:
+                        value = None
+            return True, value
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            return False, None
       
 
 
+# -----------------------------
+# Expresiones SQL compartidas
+# -----------------------------
+# Expresión SQL que convierte el texto de jornada ('DD/MM/YYYY HH24:MI') en datos.jornada_ts
+SQL_JORNADA_TS = "to_timestamp(%s, 'DD/MM/YYYY HH24:MI')::timestamp"
+
+# Clave normalizada de máquina (minúsculas, solo [0-9a-z]) para cruzar maquinas.numero ↔ datos.maquina.
+# Se guarda en maquinas.numero_norm y datos.maquina_norm.
+SQL_MAQUINA_NORM = "regexp_replace(btrim(lower(%s::text)),'[^0-9a-z]+','','g')"
+
+# Resumen por máquina/día (datos_diario) que usa el dashboard de hold.
+# Agregado de un conjunto de filas con las columnas de datos; se suma a lo ya acumulado.
+SQL_DIARIO_AGREGADO = """
+    SELECT maquina, maquina_norm, jornada_ts::date AS dia,
+           COALESCE(SUM(total_in), 0),
+           COALESCE(SUM(total_out), 0),
+           COALESCE(SUM(total_in - total_out), 0),
+           COALESCE(SUM(jugado), 0),
+           COALESCE(bool_or(COALESCE(jugado, 0) > 0), false),
+           COUNT(*)
+    FROM {origen}
+    WHERE jornada_ts IS NOT NULL AND maquina IS NOT NULL {filtro}
+    GROUP BY maquina, maquina_norm, jornada_ts::date
+"""
+SQL_DIARIO_UPSERT = """
+    INSERT INTO datos_diario AS dd
+        (maquina, maquina_norm, dia, total_in, total_out, win, jugado, jugado_pos, filas)
+    """ + SQL_DIARIO_AGREGADO + """
+    ON CONFLICT (maquina, dia) DO UPDATE SET
+        total_in   = dd.total_in   + EXCLUDED.total_in,
+        total_out  = dd.total_out  + EXCLUDED.total_out,
+        win        = dd.win        + EXCLUDED.win,
+        jugado     = dd.jugado     + EXCLUDED.jugado,
+        jugado_pos = dd.jugado_pos OR EXCLUDED.jugado_pos,
+        filas      = dd.filas      + EXCLUDED.filas
+"""
+# Reconstrucción completa desde datos (migración y comando reconstruir-diario)
+SQL_DIARIO_RECONSTRUIR = """
+    DELETE FROM datos_diario;
+    INSERT INTO datos_diario
+        (maquina, maquina_norm, dia, total_in, total_out, win, jugado, jugado_pos, filas)
+    """ + SQL_DIARIO_AGREGADO.format(origen="datos", filtro="") + ";"
+
+# Calendario de días con datos (datos_periodos) para los selectores de año/mes/día de hold
+SQL_PERIODOS_RECONSTRUIR = """
+    DELETE FROM datos_periodos WHERE TRUE {filtro};
+    INSERT INTO datos_periodos (dia)
+    SELECT DISTINCT dia FROM datos_diario WHERE TRUE {filtro}
+    ON CONFLICT DO NOTHING;
+"""
+
+# Instala el trigger que versiona (cache_versiones) cada escritura sobre las tablas dadas
+SQL_VIGILAR_TABLAS = """
+    DO $$
+    DECLARE t text;
+    BEGIN
+        FOREACH t IN ARRAY ARRAY[{tablas}] LOOP
+            INSERT INTO cache_versiones (nombre) VALUES (t) ON CONFLICT DO NOTHING;
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_cache_version ON %I', t);
+            EXECUTE format('CREATE TRIGGER trg_cache_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I FOR EACH STATEMENT EXECUTE PROCEDURE cache_version_incrementar()', t);
+        END LOOP;
+    END
+    $$;
+"""
+
+# Versiona por mes (cache_versiones_mes) cada escritura sobre una tabla; {mes} es la expresión que da
+# el primer día del mes de cada fila. TRUNCATE incrementa todos los meses de la tabla.
+SQL_VIGILAR_MESES = """
+    DROP TRIGGER IF EXISTS trg_cache_mes_ins ON {tabla};
+    DROP TRIGGER IF EXISTS trg_cache_mes_upd ON {tabla};
+    DROP TRIGGER IF EXISTS trg_cache_mes_del ON {tabla};
+    DROP TRIGGER IF EXISTS trg_cache_mes_trunc ON {tabla};
+    CREATE TRIGGER trg_cache_mes_ins AFTER INSERT ON {tabla} REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE PROCEDURE cache_version_mes_incrementar($${mes}$$);
+    CREATE TRIGGER trg_cache_mes_upd AFTER UPDATE ON {tabla} REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE PROCEDURE cache_version_mes_incrementar($${mes}$$);
+    CREATE TRIGGER trg_cache_mes_del AFTER DELETE ON {tabla} REFERENCING OLD TABLE AS viejas
+        FOR EACH STATEMENT EXECUTE PROCEDURE cache_version_mes_incrementar($${mes}$$);
+    CREATE TRIGGER trg_cache_mes_trunc AFTER TRUNCATE ON {tabla}
+        FOR EACH STATEMENT EXECUTE PROCEDURE cache_version_mes_incrementar();
+    INSERT INTO cache_versiones_mes (tabla, mes)
+    SELECT DISTINCT '{tabla}', mes FROM (SELECT {mes} AS mes FROM {tabla}) t WHERE mes IS NOT NULL
+    ON CONFLICT DO NOTHING;
+"""
+# Mes de cada fila de tipo_cambio (el mes se guarda por nombre)
+SQL_TIPO_CAMBIO_MES = (
+    "CASE WHEN anio BETWEEN 1 AND 9999 THEN make_date(anio, array_position(ARRAY['Enero','Febrero','Marzo',"
+    "'Abril','Mayo','Junio','Julio','Agosto','Septiembre','Octubre','Noviembre','Diciembre'], "
+    "initcap(btrim(mes::text))), 1) END"
+)
+
+
+# -----------------------------
+# Migraciones de esquema
+# -----------------------------
+# Se aplican en orden y una sola vez con:  flask --app app migrar
+MIGRACIONES = [
+    ("001_datos_jornada_ts", """
+        ALTER TABLE datos ADD COLUMN IF NOT EXISTS jornada_ts timestamp;
+        -- Una jornada mal escrita queda con jornada_ts NULL en vez de abortar la migración
+        CREATE OR REPLACE FUNCTION jornada_ts_o_null(jornada text) RETURNS timestamp
+        LANGUAGE plpgsql IMMUTABLE AS $$
+        BEGIN
+            IF jornada !~ '^\\s*\\d{1,2}/\\d{1,2}/\\d{4}\\s+\\d{1,2}:\\d{2}\\s*$' THEN
+                RETURN NULL;
+            END IF;
+            RETURN to_timestamp(jornada, 'DD/MM/YYYY HH24:MI')::timestamp;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END
+        $$;
+        UPDATE datos
+           SET jornada_ts = jornada_ts_o_null(jornada)
+         WHERE jornada_ts IS NULL AND jornada IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS ix_datos_jornada_ts ON datos (jornada_ts);
+    """),
+    ("002_clave_maquina_normalizada", """
+        ALTER TABLE maquinas ADD COLUMN IF NOT EXISTS numero_norm text;
+        UPDATE maquinas
+           SET numero_norm = regexp_replace(btrim(lower(numero::text)),'[^0-9a-z]+','','g')
+         WHERE numero_norm IS NULL;
+        CREATE INDEX IF NOT EXISTS ix_maquinas_numero_norm ON maquinas (numero_norm);
+
+        ALTER TABLE datos ADD COLUMN IF NOT EXISTS maquina_norm text;
+        UPDATE datos
+           SET maquina_norm = regexp_replace(btrim(lower(maquina::text)),'[^0-9a-z]+','','g')
+         WHERE maquina_norm IS NULL;
+        CREATE INDEX IF NOT EXISTS ix_datos_maquina_norm ON datos (maquina_norm, jornada_ts);
+    """),
+    ("003_datos_diario", """
+        CREATE TABLE IF NOT EXISTS datos_diario (
+            maquina      text    NOT NULL,
+            maquina_norm text,
+            dia          date    NOT NULL,
+            total_in     numeric NOT NULL DEFAULT 0,
+            total_out    numeric NOT NULL DEFAULT 0,
+            win          numeric NOT NULL DEFAULT 0,
+            jugado       numeric NOT NULL DEFAULT 0,
+            jugado_pos   boolean NOT NULL DEFAULT false,
+            filas        integer NOT NULL DEFAULT 0,
+            PRIMARY KEY (maquina, dia)
+        );
+        CREATE INDEX IF NOT EXISTS ix_datos_diario_dia ON datos_diario (dia);
+        CREATE INDEX IF NOT EXISTS ix_datos_diario_maquina_norm ON datos_diario (maquina_norm, dia);
+    """ + SQL_DIARIO_RECONSTRUIR),
+    ("004_cache_versiones", """
+        CREATE TABLE IF NOT EXISTS cache_versiones (
+            nombre      text        PRIMARY KEY,
+            version     bigint      NOT NULL DEFAULT 1,
+            actualizado timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE OR REPLACE FUNCTION cache_version_incrementar() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO cache_versiones (nombre) VALUES (TG_TABLE_NAME)
+            ON CONFLICT (nombre) DO UPDATE
+               SET version = cache_versiones.version + 1, actualizado = now();
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    """ + SQL_VIGILAR_TABLAS.format(tablas="'estado','kit_wigos','modelos','progresivos','proveedores','tipo_jackpots','tipo_stacker'")),
+    ("005_vigilar_maquinas_tipo_cambio", SQL_VIGILAR_TABLAS.format(tablas="'maquinas','tipo_cambio'")),
+    # Antes la deduplicación se hacía en Python; si quedaron repetidos se borran y se rehace el resumen
+    ("006_datos_clave_unica", """
+        DO $$
+        DECLARE n bigint;
+        BEGIN
+            DELETE FROM datos a
+             USING datos b
+             WHERE a.maquina = b.maquina AND a.jornada = b.jornada AND a.ctid > b.ctid;
+            GET DIAGNOSTICS n = ROW_COUNT;
+            IF n > 0 THEN
+                """ + SQL_DIARIO_RECONSTRUIR + """
+            END IF;
+        END
+        $$;
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_datos_maquina_jornada ON datos (maquina, jornada);
+    """),
+    # Importaciones de hold en segundo plano (ver /api/hold/jobs)
+    ("007_hold_jobs", """
+        CREATE TABLE IF NOT EXISTS hold_jobs (
+            id          text        PRIMARY KEY,
+            tipo        text        NOT NULL,
+            usuario     text,
+            archivo     text,
+            estado      text        NOT NULL DEFAULT 'pendiente',
+            fase        text,
+            filas       bigint      NOT NULL DEFAULT 0,
+            resultado   jsonb,
+            creado      timestamptz NOT NULL DEFAULT now(),
+            actualizado timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS ix_hold_jobs_creado ON hold_jobs (creado);
+    """),
+    # Archivos de hold ya importados (por hash del contenido) y el rango de jornadas que cubrieron
+    ("008_hold_archivos", """
+        CREATE TABLE IF NOT EXISTS hold_archivos (
+            sha256        text        PRIMARY KEY,
+            nombre        text,
+            filas         bigint      NOT NULL DEFAULT 0,
+            insertadas    bigint      NOT NULL DEFAULT 0,
+            jornada_desde timestamp,
+            jornada_hasta timestamp,
+            importado     timestamptz NOT NULL DEFAULT now()
+        );
+    """),
+    # Versiones de datos y gastos para los ETag de la API (ver cache_http)
+    ("009_vigilar_datos_gastos", SQL_VIGILAR_TABLAS.format(tablas="'datos','gastos'")),
+    ("010_datos_periodos", """
+        CREATE TABLE IF NOT EXISTS datos_periodos (
+            dia date PRIMARY KEY
+        );
+    """ + SQL_PERIODOS_RECONSTRUIR.format(filtro="") + SQL_VIGILAR_TABLAS.format(tablas="'datos_periodos'")),
+    # Orden del listado paginado de máquinas (ver /api/maquinas)
+    ("011_maquinas_numero", """
+        CREATE INDEX IF NOT EXISTS ix_maquinas_numero ON maquinas (numero, id_maquina);
+    """),
+    # Filtros de gastos por rango de fechas (el id acompaña al orden del listado paginado)
+    ("012_gastos_fecha", """
+        CREATE INDEX IF NOT EXISTS ix_gastos_fecha ON gastos (fecha, id_gasto);
+        CREATE INDEX IF NOT EXISTS ix_gastos_maquina_fecha ON gastos (id_maquina, fecha);
+    """),
+    # Worker que corre cada trabajo de hold y su último latido (ver _hold_jobs_latir)
+    ("013_hold_jobs_latido", """
+        ALTER TABLE hold_jobs ADD COLUMN IF NOT EXISTS worker text;
+        ALTER TABLE hold_jobs ADD COLUMN IF NOT EXISTS latido timestamptz;
+        CREATE INDEX IF NOT EXISTS ix_hold_jobs_activos ON hold_jobs (worker) WHERE estado IN ('pendiente', 'en_curso');
+    """),
+    # Versiones por mes del resumen diario y del tipo de cambio (clave de hold_cache)
+    ("014_cache_versiones_mes", """
+        CREATE TABLE IF NOT EXISTS cache_versiones_mes (
+            tabla       text        NOT NULL,
+            mes         date        NOT NULL,
+            version     bigint      NOT NULL DEFAULT 1,
+            actualizado timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (tabla, mes)
+        );
+        CREATE OR REPLACE FUNCTION cache_version_mes_incrementar() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                UPDATE cache_versiones_mes SET version = version + 1, actualizado = now()
+                 WHERE tabla = TG_TABLE_NAME;
+                RETURN NULL;
+            END IF;
+            EXECUTE format(
+                'INSERT INTO cache_versiones_mes (tabla, mes)
+                 SELECT DISTINCT %L, mes FROM (SELECT %s AS mes FROM %s) t WHERE mes IS NOT NULL
+                 ON CONFLICT (tabla, mes) DO UPDATE
+                    SET version = cache_versiones_mes.version + 1, actualizado = now()',
+                TG_TABLE_NAME, TG_ARGV[0],
+                CASE TG_OP WHEN 'INSERT' THEN 'nuevas' WHEN 'DELETE' THEN 'viejas'
+                           ELSE '(SELECT * FROM nuevas UNION ALL SELECT * FROM viejas) u' END);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    """ + SQL_VIGILAR_MESES.format(tabla="datos_diario", mes="date_trunc('month', dia)::date")
+        + SQL_VIGILAR_MESES.format(tabla="tipo_cambio", mes=SQL_TIPO_CAMBIO_MES)),
+    # Las filas ya cargadas se buscan en datos: sobran las máquinas y el índice por rango de hold_archivos
+    ("015_hold_archivos_sin_maquinas", """
+        DROP INDEX IF EXISTS ix_hold_archivos_jornada;
+        ALTER TABLE hold_archivos DROP COLUMN IF EXISTS maquinas;
+    """),
+]
+
+
+def aplicar_migraciones() -> list:
+    """Aplica las migraciones pendientes, cada una en su propia transacción. Devuelve las aplicadas."""
+    aplicadas = []
+    with conexion_db() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migraciones (
+                        nombre   text PRIMARY KEY,
+                        aplicada timestamptz NOT NULL DEFAULT now()
+                    )
+                """)
+                cur.execute("SELECT nombre FROM schema_migraciones")
+                hechas = {r[0] for r in cur.fetchall()}
+
+        for nombre, sql in MIGRACIONES:
+            if nombre in hechas:
+                continue
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migraciones (nombre) VALUES (%s)", (nombre,))
+            aplicadas.append(nombre)
+    return aplicadas
+
+
+@app.cli.command("migrar")
+def migrar_cmd():
+    """Aplica las migraciones de esquema pendientes."""
+    aplicadas = aplicar_migraciones()
+    for nombre in aplicadas:
+        print("Migración aplicada:", nombre)
+    if not aplicadas:
+        print("Sin migraciones pendientes")
+
+
+def reconstruir_diario(desde: date = None, hasta: date = None) -> int:
+    """Recalcula datos_diario (y datos_periodos) desde datos, completo o solo para los días en [desde, hasta]."""
+    filtro = ""
+    borrar = ""
+    params = []
+    if desde:
+        filtro += " AND jornada_ts >= %s"
+        borrar += " AND dia >= %s"
+        params.append(desde)
+    if hasta:
+        filtro += " AND jornada_ts < %s"
+        borrar += " AND dia < %s"
+        params.append(hasta + timedelta(days=1))
+    with conexion_db() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM datos_diario WHERE TRUE" + borrar, tuple(params))
+                cur.execute(SQL_DIARIO_UPSERT.format(origen="datos", filtro=filtro), tuple(params))
+                filas = cur.rowcount
+                cur.execute(SQL_PERIODOS_RECONSTRUIR.format(filtro=borrar), tuple(params) * 2)
+                return filas
+
+
+@app.cli.command("reconstruir-diario")
+@click.option("--desde", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Primer día (YYYY-MM-DD)")
+@click.option("--hasta", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Último día (YYYY-MM-DD)")
+def reconstruir_diario_cmd(desde, hasta):
+    """Reconstruye el resumen por máquina/día (datos_diario) desde datos."""
+    filas = reconstruir_diario(desde.date() if desde else None, hasta.date() if hasta else None)
+    print("Filas de datos_diario recalculadas:", filas)
+
+
+# -----------------------------
+# Caché en memoria
+# -----------------------------
+class CacheLRU:
+    """
+    Caché LRU con expiración (TTL) y contadores de aciertos/fallos, segura para hilos.
+    Es local a cada proceso: cada worker mantiene la suya.
+    """
+
+    def __init__(self, nombre: str, maximo: int, ttl: float):
+        self.nombre = nombre
+        self.maximo = max(1, maximo)
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expiradas": 0, "desalojadas": 0, "invalidadas": 0}
+        CACHES[nombre] = self
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado o None si no está (o expiró)."""
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            expira, valor = item
+            if expira < time.monotonic():
+                del self._datos[clave]
+                self._stats["expiradas"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._datos.move_to_end(clave)
+            self._stats["hits"] += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+                self._stats["desalojadas"] += 1
+
+    def invalidar(self, predicado=None) -> int:
+        """Elimina las entradas para las que predicado(clave, valor) es verdadero (todas si no se pasa)."""
+        with self._lock:
+            if predicado is None:
+                claves = list(self._datos)
+            else:
+                claves = [k for k, (_, v) in self._datos.items() if predicado(k, v)]
+            for k in claves:
+                del self._datos[k]
+            self._stats["invalidadas"] += len(claves)
+            return len(claves)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._datos), "max": self.maximo, "ttl": self.ttl, **self._stats}
+
+
+# Registro de cachés del proceso (para /api/cache)
+CACHES = {}
+
+
+# -----------------------------
+# Versiones de datos (sincronización entre workers)
+# -----------------------------
+# Los triggers de la migración 004 incrementan cache_versiones.version en cada escritura
+# sobre las tablas vigiladas. Cada worker lee la tabla como mucho cada VERSIONES_CHECK_SEG
+# segundos y descarta lo que cacheó con una versión anterior.
+VERSIONES_CHECK_SEG = float(os.environ.get("VERSIONES_CHECK_SEG", "2"))
+_versiones = {"leidas": 0.0, "valores": {}, "actualizado": {}}
+_versiones_lock = threading.Lock()
+
+
+def _leer_versiones():
+    with _versiones_lock:
+        if time.monotonic() - _versiones["leidas"] < VERSIONES_CHECK_SEG:
+            return _versiones
+    filas = query_todos("""
+        SELECT nombre, version, actualizado FROM cache_versiones
+        UNION ALL
+        SELECT tabla || ':' || to_char(mes, 'YYYY-MM'), version, actualizado FROM cache_versiones_mes
+    """)
+    with _versiones_lock:
+        _versiones["valores"] = {r["nombre"]: r["version"] for r in filas}
+        _versiones["actualizado"] = {r["nombre"]: r["actualizado"] for r in filas}
+        _versiones["leidas"] = time.monotonic()
+        return _versiones
+
+
+def versiones_datos() -> dict:
+    """
+    Versión actual de cada tabla vigilada (nombre -> version). Las vigiladas por mes (migración 014)
+    aparecen además como 'tabla:YYYY-MM' (ver version_mes).
+    """
+    return _leer_versiones()["valores"]
+
+
+def version_mes(tabla: str, anio: int, mes: int):
+    """Versión de los datos de 'tabla' en ese mes (None si nunca tuvo filas)."""
+    return versiones_datos().get(f"{tabla}:{anio:04d}-{mes:02d}")
+
+
+def actualizacion_datos(tablas) -> datetime | None:
+    """Última modificación registrada entre las tablas vigiladas indicadas."""
+    fechas = _leer_versiones()["actualizado"]
+    return max((fechas[t] for t in tablas if t in fechas), default=None)
+
+
+def olvidar_versiones():
+    """Fuerza releer las versiones en la próxima consulta (tras una escritura propia)."""
+    with _versiones_lock:
+        _versiones["leidas"] = 0.0
+
+
+def cache_http(*tablas, diario: bool = False):
+    """
+    Decorador para GET de la API cuyo resultado depende solo de 'tablas' (vigiladas en cache_versiones),
+    de la URL y del usuario. Responde con ETag y Last-Modified; si el cliente ya tiene esa versión
+    (If-None-Match / If-Modified-Since) devuelve 304 sin ejecutar la vista ni sus consultas.
+    diario=True para respuestas que además cambian con la fecha de hoy.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def wrapper(*args, **kwargs):
+            if not is_logged_in():
+                return vista(*args, **kwargs)
+
+            versiones = versiones_datos()
+            hoy = date.today()
+            clave = (request.full_path, session.get("usuario"), session.get("rol"),
+                     tuple(versiones.get(t) for t in tablas), hoy if diario else None)
+            etag = hashlib.sha1(repr(clave).encode("utf-8")).hexdigest()[:24]
+            modificado = actualizacion_datos(tablas)
+            if diario:
+                inicio_dia = datetime.combine(hoy, datetime.min.time()).astimezone()
+                modificado = max(modificado, inicio_dia) if modificado else inicio_dia
+            if modificado:
+                modificado = modificado.replace(microsecond=0)
+
+            if request.if_none_match:
+                vigente = request.if_none_match.contains_weak(etag)
+            else:
+                vigente = bool(modificado and request.if_modified_since and modificado <= request.if_modified_since)
+            if vigente:
+                resp = app.response_class(status=304)
+            else:
+                resp = app.make_response(vista(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag, weak=True)
+            if modificado:
+                resp.last_modified = modificado
+            # El navegador guarda la respuesta pero la revalida siempre (barato gracias al 304)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.vary.add("Cookie")
+            return resp
+        return wrapper
+    return decorador
+
+
+# -----------------------------
+# Catálogos (tablas de consulta)
+# -----------------------------
+# nombre -> (tablas de las que depende, consulta). Las filas se comparten entre peticiones:
+# las vistas no deben modificarlas.
+CATALOGOS = {
+    "estados": ({"estado"}, "SELECT id_estado, estado FROM estado ORDER BY id_estado"),
+    "estados_nombre": ({"estado"}, "SELECT id_estado, estado FROM estado ORDER BY estado"),
+    "kit_wigos": ({"kit_wigos"}, "SELECT id_kit, name_kit FROM kit_wigos ORDER BY id_kit"),
+    "modelos": ({"modelos", "proveedores"}, "SELECT m.id_modelo, m.name_modelo, m.id_proveedor, p.name_proveedor FROM modelos m LEFT JOIN proveedores p ON m.id_proveedor = p.id_proveedor ORDER BY m.name_modelo"),
+    "progresivos": ({"progresivos"}, "SELECT id_progresivo, name_progresivo FROM progresivos ORDER BY name_progresivo"),
+    "proveedores": ({"proveedores"}, "SELECT id_proveedor, name_proveedor FROM proveedores ORDER BY name_proveedor"),
+    "proveedores_modelos": ({"modelos", "proveedores"}, "SELECT pr.name_proveedor, mo.name_modelo FROM modelos mo JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor ORDER BY pr.name_proveedor, mo.name_modelo LIMIT 2000"),
+    "tipo_jackpots": ({"tipo_jackpots"}, "SELECT id_tipo, name_jackpot FROM tipo_jackpots ORDER BY id_tipo"),
+    "tipo_stacker": ({"tipo_stacker"}, "SELECT id_stacker, name_stacker FROM tipo_stacker ORDER BY id_stacker"),
+    # Días con datos de hold, para los selectores de año/mes/día
+    "periodos": ({"datos_periodos"}, "SELECT EXTRACT(YEAR FROM dia)::int AS anio, EXTRACT(MONTH FROM dia)::int AS mes, EXTRACT(DAY FROM dia)::int AS dia FROM datos_periodos ORDER BY dia"),
+    # Años del selector de gastos: del último al primero con gastos (min/max salen del índice de fecha)
+    "gastos_anios": ({"gastos"}, "SELECT generate_series(EXTRACT(YEAR FROM MAX(fecha))::int, EXTRACT(YEAR FROM MIN(fecha))::int, -1) AS anio FROM gastos"),
+    # Selector de máquina de gastos y tabla de tipos de cambio de inicio
+    "maquinas_numero": ({"maquinas"}, "SELECT id_maquina, numero FROM maquinas ORDER BY numero"),
+    "tipo_cambio": ({"tipo_cambio"}, "SELECT anio, mes, valor_cambio FROM tipo_cambio ORDER BY id_cambio DESC LIMIT 1000"),
+}
+# El TTL es solo una red de seguridad: la validez la decide la versión de las tablas
+CATALOGO_TTL = float(os.environ.get("CATALOGO_TTL", "3600"))
+
+catalogo_cache = CacheLRU("catalogos", len(CATALOGOS), CATALOGO_TTL)
+
+
+def catalogos(*nombres, extra=()) -> list:
+    """
+    Devuelve las filas de los catálogos pedidos; los que falten o estén desactualizados se cargan en un solo viaje.
+    extra: consultas (modo, sql, params) de la vista que viajan en ese mismo lote; sus resultados van al final.
+    """
+    versiones = versiones_datos()
+    resultado = {}
+    faltan = []
+    for nombre in nombres:
+        version = tuple(versiones.get(t, 0) for t in sorted(CATALOGOS[nombre][0]))
+        item = catalogo_cache.obtener(nombre)
+        if item is not None and item[0] == version:
+            resultado[nombre] = item[1]
+        else:
+            faltan.append((nombre, version))
+
+    extra = list(extra)
+    otros = []
+    if faltan or extra:
+        filas = query_lote([("todos", CATALOGOS[nombre][1], None) for nombre, _ in faltan] + extra)
+        otros = filas[len(faltan):]
+        for (nombre, version), f in zip(faltan, filas):
+            catalogo_cache.guardar(nombre, (version, f))
+            resultado[nombre] = f
+    return [resultado[n] for n in nombres] + otros
+
+
+def invalidar_catalogos(tabla: str) -> int:
+    """Descarta los catálogos que dependen de la tabla (los demás workers lo notan por la versión)."""
+    olvidar_versiones()
+    return catalogo_cache.invalidar(lambda k, _: tabla in CATALOGOS[k][0])
+
+
 # -----------------------------
 # Autenticación y helpers
 # -----------------------------
@@ -191,6 +1043,21 @@ def _to_float(x):
     except Exception:
         return None
 
+
+
+def _rango_anio(anio: int):
+    """[1 de enero, 1 de enero siguiente) para filtrar columnas fecha/timestamp con índice."""
+    anio = min(max(anio, 1), 9998)  # años fuera de rango simplemente no tienen datos
+    return date(anio, 1, 1), date(anio + 1, 1, 1)
+
+
+def _rango_mes(anio: int, mes: int):
+    """[día 1 del mes, día 1 del mes siguiente) para filtrar columnas fecha/timestamp con índice."""
+    anio = min(max(anio, 1), 9998)
+    if mes == 12:
+        return date(anio, 12, 1), date(anio + 1, 1, 1)
+    return date(anio, mes, 1), date(anio, mes + 1, 1)
+
 def _safe_div(a, b):
     """
     Divide con conversión previa y evita división por cero.
@@ -202,6 +1069,27 @@ def _safe_div(a, b):
     return af / bf
 
 
+# Respuestas JSON desde este tamaño se comprimen si el cliente lo acepta
+COMPRIMIR_MIN_BYTES = 1024
+
+
+def jsonify_comprimido(payload, status: int = 200):
+    """Como jsonify, pero comprime con gzip o deflate (según Accept-Encoding) las respuestas grandes."""
+    resp = jsonify(payload)
+    resp.status_code = status
+    resp.vary.add("Accept-Encoding")
+    cuerpo = resp.get_data()
+    if len(cuerpo) < COMPRIMIR_MIN_BYTES:
+        return resp
+    if request.accept_encodings["gzip"]:
+        resp.set_data(gzip.compress(cuerpo, compresslevel=5))
+        resp.headers["Content-Encoding"] = "gzip"
+    elif request.accept_encodings["deflate"]:
+        resp.set_data(zlib.compress(cuerpo, 5))
+        resp.headers["Content-Encoding"] = "deflate"
+    return resp
+
+
 
 # -----------------------------
 # Rutas de autenticación
@@ -233,67 +1121,74 @@ def logout():
 # -----------------------------
 # Página principal (panel)
 # -----------------------------
+# Contadores del panel en una sola pasada sobre maquinas
+SQL_INICIO_CONTADORES = """
+    SELECT
+      COUNT(*)                                             AS maquinas_total,
+      COUNT(*) FILTER (WHERE e.estado = 'Activo')          AS maquinas_activas,
+      COUNT(*) FILTER (WHERE s.name_stacker = 'UBA')       AS stacker_uba,
+      COUNT(*) FILTER (WHERE s.name_stacker = 'Ivizion')   AS stacker_ivizion,
+      COUNT(*) FILTER (WHERE s.name_stacker = 'MEI')       AS stacker_mei,
+      COUNT(*) FILTER (WHERE p.name_jackpot = 'Progresivo')   AS prog_progresivo,
+      COUNT(*) FILTER (WHERE p.name_jackpot = 'Maxi Jackpot') AS prog_maxi,
+      COUNT(*) FILTER (WHERE kw.name_kit = '5.5')          AS wigos_55,
+      COUNT(*) FILTER (WHERE kw.name_kit = '6.4')          AS wigos_64,
+      (SELECT COUNT(*) FROM modelos)                       AS modelos_total,
+      (SELECT COUNT(*) FROM tipo_cambio)                   AS tipo_cambio_total,
+      (SELECT valor_cambio FROM tipo_cambio WHERE anio = %s AND mes = %s LIMIT 1) AS valor_cambio_actual
+    FROM maquinas m
+    LEFT JOIN estado e         ON e.id_estado = m.id_estado
+    LEFT JOIN tipo_stacker s   ON s.id_stacker = m.id_stacker
+    LEFT JOIN tipo_jackpots p  ON p.id_tipo = m.id_tipo
+    LEFT JOIN kit_wigos kw     ON kw.id_kit = m.id_kit
+"""
+# Tablas de las que dependen los contadores (su versión forma parte de la clave de caché)
+INICIO_TABLAS = ("estado", "kit_wigos", "maquinas", "modelos", "tipo_cambio", "tipo_jackpots", "tipo_stacker")
+INICIO_CACHE_TTL = float(os.environ.get("INICIO_CACHE_TTL", "30"))
+
+inicio_cache = CacheLRU("inicio", 4, INICIO_CACHE_TTL)
+
+
+def _inicio_clave(anio: int, mes: str) -> tuple:
+    versiones = versiones_datos()
+    return (anio, mes) + tuple(versiones.get(t, 0) for t in INICIO_TABLAS)
+
+
+def contadores_inicio(anio: int, mes: str) -> dict:
+    """Contadores del panel para el mes dado, cacheados mientras no cambien las tablas de origen."""
+    clave = _inicio_clave(anio, mes)
+    contadores = inicio_cache.obtener(clave)
+    if contadores is None:
+        contadores = query_uno(SQL_INICIO_CONTADORES, (anio, mes))
+        inicio_cache.guardar(clave, contadores)
+    return contadores
+
+
 @app.route('/')
 @app.route('/inicio')
+@snapshot_lectura
 def inicio():
     if not is_logged_in():
         return redirect(url_for("login"))
 
     fecha_actual = date.today()
-    meses = [
-        "Enero",
-        "Febrero",
-        "Marzo",
-        "Abril",
-        "Mayo",
-        "Junio",
-        "Julio",
-        "Agosto",
-        "Septiembre",
-        "Octubre",
-        "Noviembre",
-        "Diciembre",
-    ]
     anio = fecha_actual.year
     mes_num = fecha_actual.month
-    mes = meses[mes_num - 1]
-
-    tipo_cambio_actual = (
-        query_uno(
-            "SELECT anio, mes, valor_cambio FROM tipo_cambio WHERE anio = %s AND mes = %s LIMIT 1",
-            (anio, mes),
-        )
-        or {"anio": anio, "mes": mes, "valor_cambio": "-"}
-    )
-
-    maquinas_activas = query_valor(
-        "SELECT COUNT(*) FROM maquinas m JOIN estado e ON e.id_estado = m.id_estado WHERE e.estado = 'Activo'"
-    ) or 0
-
-    stacks = query_uno(
-        "SELECT SUM(CASE WHEN s.name_stacker = 'UBA' THEN 1 ELSE 0 END) AS uba, SUM(CASE WHEN s.name_stacker = 'Ivizion' THEN 1 ELSE 0 END) AS ivizion, SUM(CASE WHEN s.name_stacker = 'MEI' THEN 1 ELSE 0 END) AS mei FROM maquinas m JOIN tipo_stacker s ON s.id_stacker = m.id_stacker"
-    ) or {"uba": 0, "ivizion": 0, "mei": 0}
-
-    progs = query_uno(
-        "SELECT SUM(CASE WHEN p.name_jackpot = 'Progresivo' THEN 1 ELSE 0 END) AS progresivo, SUM(CASE WHEN p.name_jackpot = 'Maxi Jackpot' THEN 1 ELSE 0 END) AS maxi_jackpot FROM maquinas m JOIN tipo_jackpots p ON p.id_tipo = m.id_tipo"
-    ) or {"progresivo": 0, "maxi_jackpot": 0}
-
-    wigos = query_uno(
-        "SELECT SUM(CASE WHEN kw.name_kit = '5.5' THEN 1 ELSE 0 END) AS wigos_55, SUM(CASE WHEN kw.name_kit = '6.4' THEN 1 ELSE 0 END) AS wigos_64 FROM maquinas m JOIN kit_wigos kw ON kw.id_kit = m.id_kit"
-    ) or {"wigos_55": 0, "wigos_64": 0}
-
-    maquinas = query_todos(
-        "SELECT m.numero, mo.name_modelo, pr.name_proveedor, e.estado, ts.name_stacker, p.name_progresivo, m.piso, m.serie FROM maquinas m LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo LEFT JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor LEFT JOIN estado e ON e.id_estado = m.id_estado LEFT JOIN tipo_stacker ts ON ts.id_stacker = m.id_stacker LEFT JOIN progresivos p ON p.id_progresivo = m.id_progresivo WHERE e.estado = 'Activo' ORDER BY m.numero LIMIT 1000"
-    )
-    maquinas_count = query_valor("SELECT COUNT(*) FROM maquinas") or 0
-
-    proveedores_modelos = query_todos(
-        "SELECT pr.name_proveedor, mo.name_modelo FROM modelos mo JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor ORDER BY pr.name_proveedor, mo.name_modelo LIMIT 2000"
+    mes = MESES_NOMBRE[mes_num - 1]
+
+    # Contadores y catálogos desde la caché; lo que falte viaja en una sola consulta.
+    # Las máquinas activas las pide la página por partes a /api/maquinas
+    clave = _inicio_clave(anio, mes)
+    c = inicio_cache.obtener(clave)
+    proveedores_modelos, tipo_cambio, *contadores = catalogos(
+        "proveedores_modelos", "tipo_cambio",
+        extra=[] if c is not None else [("uno", SQL_INICIO_CONTADORES, (anio, mes))],
     )
-    proveedores_modelos_count = query_valor("SELECT COUNT(*) FROM modelos") or 0
-
-    tipo_cambio = query_todos("SELECT anio, mes, valor_cambio FROM tipo_cambio ORDER BY id_cambio DESC LIMIT 1000")
-    tipo_cambio_count = query_valor("SELECT COUNT(*) FROM tipo_cambio") or 0
+    if c is None:
+        c = contadores[0]
+        inicio_cache.guardar(clave, c)
+    valor_cambio = c["valor_cambio_actual"]
+    tipo_cambio_actual = {"anio": anio, "mes": mes, "valor_cambio": "-" if valor_cambio is None else valor_cambio}
 
     return render_template(
         "inicio.html",
@@ -301,78 +1196,112 @@ def inicio():
         rol=session["rol"],
         fecha_actual=fecha_actual,
         tipo_cambio_actual=tipo_cambio_actual,
-        maquinas_activas=maquinas_activas,
-        maquinas_stacker_uba=stacks.get("uba", 0),
-        maquinas_stacker_ivizion=stacks.get("ivizion", 0),
-        maquinas_stacker_mei=stacks.get("mei", 0),
-        maquinas_prog_progresivo=progs.get("progresivo", 0),
-        maquinas_prog_maxi=progs.get("maxi_jackpot", 0),
+        maquinas_activas=c["maquinas_activas"],
+        maquinas_stacker_uba=c["stacker_uba"],
+        maquinas_stacker_ivizion=c["stacker_ivizion"],
+        maquinas_stacker_mei=c["stacker_mei"],
+        maquinas_prog_progresivo=c["prog_progresivo"],
+        maquinas_prog_maxi=c["prog_maxi"],
         mes_num=mes_num,
         mes=mes,
-        wigos_55=wigos.get("wigos_55", 0),
-        wigos_64=wigos.get("wigos_64", 0),
-        maquinas=maquinas,
-        maquinas_count=maquinas_count,
+        wigos_55=c["wigos_55"],
+        wigos_64=c["wigos_64"],
+        maquinas_count=c["maquinas_total"],
         proveedores_modelos=proveedores_modelos,
-        proveedores_modelos_count=proveedores_modelos_count,
+        proveedores_modelos_count=c["modelos_total"],
         tipo_cambio=tipo_cambio,
-        tipo_cambio_count=tipo_cambio_count,
+        tipo_cambio_count=c["tipo_cambio_total"],
     )
 
 
+@app.route('/api/inicio/resumen')
+@snapshot_lectura
+def api_inicio_resumen():
+    if not is_logged_in():
+        return jsonify(ok=False, msg="No autorizado"), 401
+    hoy = date.today()
+    mes = MESES_NOMBRE[hoy.month - 1]
+    c = contadores_inicio(hoy.year, mes)
+    return jsonify(ok=True, anio=hoy.year, mes=mes, **c)
+
+
 # -----------------------------
 # Sección: Máquinas (vistas y API)
 # -----------------------------
+# Listado de máquinas con sus nombres de catálogo; {where} filtra y pagina
+SQL_MAQUINAS_LISTADO = """
+  SELECT
+    m.id_maquina, m.numero, m.piso, m.serie,
+    e.estado,
+    mo.id_modelo, mo.name_modelo,
+    pr.name_proveedor,
+    tj.name_jackpot,
+    ts.name_stacker,
+    kw.name_kit,
+    pg.name_progresivo
+  FROM maquinas m
+  LEFT JOIN estado e        ON e.id_estado = m.id_estado
+  LEFT JOIN modelos mo      ON mo.id_modelo = m.id_modelo
+  LEFT JOIN proveedores pr  ON pr.id_proveedor = mo.id_proveedor
+  LEFT JOIN tipo_jackpots tj ON tj.id_tipo = m.id_tipo
+  LEFT JOIN tipo_stacker ts ON ts.id_stacker = m.id_stacker
+  LEFT JOIN kit_wigos kw    ON kw.id_kit = m.id_kit
+  LEFT JOIN progresivos pg  ON pg.id_progresivo = m.id_progresivo
+  {where}
+  ORDER BY m.numero, m.id_maquina
+  LIMIT %s
+"""
+
+# Filas por página del listado (por defecto y máximo que se puede pedir con ?limit=)
+MAQUINAS_PAGINA = int(os.environ.get("MAQUINAS_PAGINA", "100"))
+MAQUINAS_PAGINA_MAX = 500
+
+
+def _maquinas_filtros():
+    """Condiciones y parámetros de ?estado= (nombre), ?modelo=, ?piso= y ?stacker= (ids)."""
+    condiciones, params = [], []
+    estado = request.args.get("estado")
+    if estado:
+        condiciones.append("e.estado = %s")
+        params.append(estado)
+    modelo = request.args.get("modelo", type=int)
+    if modelo is not None:
+        condiciones.append("m.id_modelo = %s")
+        params.append(modelo)
+    piso = request.args.get("piso")
+    if piso:
+        condiciones.append("m.piso = %s")
+        params.append(piso)
+    stacker = request.args.get("stacker", type=int)
+    if stacker is not None:
+        condiciones.append("m.id_stacker = %s")
+        params.append(stacker)
+    return condiciones, params
+
+
 @app.route("/maquinas")
+@snapshot_lectura
 def maquinas():
     if not is_logged_in():
         return redirect(url_for("login"))
 
     filtro_estado = request.args.get("estado")  # "Activo" / "Inactivo" / None
-    where_clause = ""
-    params = ()
-    if filtro_estado:
-        where_clause = "WHERE e.estado = %s"
-        params = (filtro_estado,)
-
-    sql = f"""
-      SELECT
-        m.id_maquina, m.numero, m.piso, m.serie,
-        e.estado,
-        mo.id_modelo, mo.name_modelo,
-        pr.name_proveedor,
-        tj.name_jackpot,
-        ts.name_stacker,
-        kw.name_kit,
-        pg.name_progresivo
-      FROM maquinas m
-      LEFT JOIN estado e        ON e.id_estado = m.id_estado
-      LEFT JOIN modelos mo      ON mo.id_modelo = m.id_modelo
-      LEFT JOIN proveedores pr  ON pr.id_proveedor = mo.id_proveedor
-      LEFT JOIN tipo_jackpots tj ON tj.id_tipo = m.id_tipo
-      LEFT JOIN tipo_stacker ts ON ts.id_stacker = m.id_stacker
-      LEFT JOIN kit_wigos kw    ON kw.id_kit = m.id_kit
-      LEFT JOIN progresivos pg  ON pg.id_progresivo = m.id_progresivo
-      {where_clause}
-      ORDER BY m.numero
-    """
-
-    modelos = query_todos("SELECT id_modelo, name_modelo FROM modelos ORDER BY name_modelo")
-    estados = query_todos("SELECT id_estado, estado FROM estado ORDER BY estado")
-    tipo_jackpots = query_todos("SELECT id_tipo, name_jackpot FROM tipo_jackpots ORDER BY id_tipo")
-    tipo_stacker = query_todos("SELECT id_stacker, name_stacker FROM tipo_stacker ORDER BY id_stacker")
-    kit_wigos = query_todos("SELECT id_kit, name_kit FROM kit_wigos ORDER BY id_kit")
-    progresivos = query_todos("SELECT id_progresivo, name_progresivo FROM progresivos ORDER BY name_progresivo")
-
-    maquinas_list = query_todos(sql, params)
-    maquinas_count = query_valor("SELECT COUNT(*) FROM maquinas") or 0
-    maquinas_activas = query_valor("SELECT COUNT(*) FROM maquinas WHERE id_estado = 1") or 0
+
+    # Los conteos viajan junto con los catálogos que falten; las filas las pide la página por partes a /api/maquinas
+    modelos, estados, tipo_jackpots, tipo_stacker, kit_wigos, progresivos, maquinas_count, maquinas_activas = catalogos(
+        "modelos", "estados_nombre", "tipo_jackpots", "tipo_stacker", "kit_wigos", "progresivos",
+        extra=[
+            ("valor", "SELECT COUNT(*) FROM maquinas", None),
+            ("valor", "SELECT COUNT(*) FROM maquinas WHERE id_estado = 1", None),
+        ],
+    )
+    maquinas_count = maquinas_count or 0
+    maquinas_activas = maquinas_activas or 0
 
     return render_template(
         "maquinas.html",
         usuario=session["usuario"],
         rol=session["rol"],
-        maquinas=maquinas_list,
         maquinas_count=maquinas_count,
         filtro_estado=filtro_estado or "",
         modelos=modelos,
@@ -382,16 +1311,59 @@ def maquinas():
         kit_wigos=kit_wigos,
         progresivos=progresivos,
         maquinas_activas=maquinas_activas,
+        maquinas_pagina=MAQUINAS_PAGINA,
     )
 
 
+@app.route("/api/maquinas")
+@cache_http("maquinas", "estado", "modelos", "proveedores", "tipo_jackpots", "tipo_stacker", "kit_wigos", "progresivos")
+def api_maquinas_listado():
+    """
+    Una página del listado, ordenado por número. La siguiente se pide con ?after=&after_id= de 'next'
+    (sin 'after' si el número es NULL, que van al final). 'total' (con los filtros) solo viene en la primera.
+    """
+    if not is_logged_in():
+        return jsonify(ok=False, msg="No autorizado"), 401
+
+    limite = min(max(request.args.get("limit", MAQUINAS_PAGINA, type=int), 1), MAQUINAS_PAGINA_MAX)
+    condiciones, params = _maquinas_filtros()
+    where_total = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+
+    after = request.args.get("after") or None
+    after_id = request.args.get("after_id", type=int)
+    condiciones_pagina, params_pagina = list(condiciones), list(params)
+    if after_id is not None:
+        if after is None:
+            condiciones_pagina.append("m.numero IS NULL AND m.id_maquina > %s")
+            params_pagina.append(after_id)
+        else:
+            condiciones_pagina.append("((m.numero, m.id_maquina) > (%s, %s) OR m.numero IS NULL)")
+            params_pagina += [after, after_id]
+    where = ("WHERE " + " AND ".join(condiciones_pagina)) if condiciones_pagina else ""
+
+    # Se pide una fila de más para saber si hay otra página
+    consultas = [("todos", SQL_MAQUINAS_LISTADO.format(where=where), (*params_pagina, limite + 1))]
+    if after_id is None:
+        consultas.append(("valor", f"SELECT COUNT(*) FROM maquinas m LEFT JOIN estado e ON e.id_estado = m.id_estado {where_total}", tuple(params)))
+    resultados = query_lote(consultas)
+    filas = resultados[0]
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = {"after": filas[-1]["numero"], "after_id": filas[-1]["id_maquina"]}
+    total = (resultados[1] or 0) if after_id is None else None
+    return jsonify_comprimido({"ok": True, "items": filas, "total": total, "next": siguiente})
+
+
 @app.route("/api/maquinas/<int:id>")
+@cache_http("maquinas")
 def api_maquina_detalle(id: int):
     d = query_uno(
         "SELECT id_maquina, id_modelo, numero, id_estado, id_tipo, id_stacker, id_kit, piso, id_progresivo, serie FROM maquinas WHERE id_maquina = %s LIMIT 1",
         (id,),
     )
-    return jsonify(d or {})
+    return jsonify_comprimido(d or {})
 
 
 @app.route("/api/maquinas", methods=["POST"])
@@ -402,7 +1374,7 @@ def api_maquina_crear():
     data = request.get_json() or {}
     try:
         ok = exec_sql(
-            "INSERT INTO maquinas (id_modelo, numero, id_estado, id_tipo, id_stacker, id_kit, piso, id_progresivo, serie) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+            "INSERT INTO maquinas (id_modelo, numero, id_estado, id_tipo, id_stacker, id_kit, piso, id_progresivo, serie, numero_norm) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s," + SQL_MAQUINA_NORM + ")",
             (
                 data.get("id_modelo") or None,
                 data.get("numero") or None,
@@ -413,8 +1385,12 @@ def api_maquina_crear():
                 data.get("piso") or None,
                 data.get("id_progresivo") or None,
                 data.get("serie") or None,
+                data.get("numero") or None,
             ),
         )
+        if ok:
+            hold_cache.invalidar()
+            olvidar_versiones()
         return jsonify(ok=bool(ok), msg="Creado" if ok else "Error al crear")
     except Exception as e:
         print("DB create error: ", e)
@@ -428,7 +1404,7 @@ def api_maquina_actualizar(id: int):
 
     data = request.get_json() or {}
     ok = exec_sql(
-        "UPDATE maquinas SET id_modelo=%s, numero=%s, id_estado=%s, id_tipo=%s, id_stacker=%s, id_kit=%s, piso=%s, id_progresivo=%s, serie=%s WHERE id_maquina=%s",
+        "UPDATE maquinas SET id_modelo=%s, numero=%s, id_estado=%s, id_tipo=%s, id_stacker=%s, id_kit=%s, piso=%s, id_progresivo=%s, serie=%s, numero_norm=" + SQL_MAQUINA_NORM + " WHERE id_maquina=%s",
         (
             data.get("id_modelo") or None,
             data.get("numero") or None,
@@ -439,9 +1415,13 @@ def api_maquina_actualizar(id: int):
             data.get("piso") or None,
             data.get("id_progresivo") or None,
             data.get("serie") or None,
+            data.get("numero") or None,
             id,
         ),
     )
+    if ok:
+        hold_cache.invalidar()
+        olvidar_versiones()
     return jsonify(ok=bool(ok), msg="Actualizado" if ok else "Error al actualizar")
 
 
@@ -451,6 +1431,9 @@ def api_maquina_eliminar(id: int):
         return jsonify(ok=False, msg="No autorizado"), 403
     try:
         ok = exec_sql("DELETE FROM maquinas WHERE id_maquina=%s", (id,))
+        if ok:
+            hold_cache.invalidar()
+            olvidar_versiones()
         return jsonify(ok=bool(ok), msg="Eliminado" if ok else "No eliminado")
     except Exception as e:
         print("DB error:", e)
@@ -471,9 +1454,12 @@ RESOURCE_MAP = {
     "tipo_stacker": {"table": "tipo_stacker", "id": "id_stacker", "fields": ["name_stacker"]},
     "usuarios": {"table": "usuarios", "id": "id_usuario", "fields": ["name_usuario", "rol", "pass_usuario"]},
 }
+# Recursos cuyo cambio afecta al contexto de hold (sidebar y filtro por modelo)
+HOLD_RECURSOS = {"modelos"}
 
 
 @app.route("/configuracion")
+@snapshot_lectura
 def configuracion():
     if not is_logged_in():
         return redirect(url_for("login"))
@@ -481,17 +1467,11 @@ def configuracion():
         flash("Acceso denegado: se requiere rol Admin")
         return redirect(url_for("inicio"))
 
-    # Consultas que devuelven los nombres relacionados donde corresponde
-    kit_wigos = query_todos("SELECT id_kit, name_kit FROM kit_wigos ORDER BY id_kit")
-    modelos = query_todos(
-        "SELECT m.id_modelo, m.name_modelo, m.id_proveedor, p.name_proveedor FROM modelos m LEFT JOIN proveedores p ON m.id_proveedor = p.id_proveedor ORDER BY m.name_modelo"
+    # Catálogos desde la caché (con los nombres relacionados donde corresponde); usuarios siempre de la BD
+    kit_wigos, modelos, progresivos, proveedores, tipo_jackpots, tipo_stacker, estados, usuarios = catalogos(
+        "kit_wigos", "modelos", "progresivos", "proveedores", "tipo_jackpots", "tipo_stacker", "estados",
+        extra=[("todos", "SELECT id_usuario, name_usuario, rol FROM usuarios ORDER BY name_usuario", None)],
     )
-    progresivos = query_todos("SELECT id_progresivo, name_progresivo FROM progresivos ORDER BY name_progresivo")
-    proveedores = query_todos("SELECT id_proveedor, name_proveedor FROM proveedores ORDER BY name_proveedor")
-    tipo_jackpots = query_todos("SELECT id_tipo, name_jackpot FROM tipo_jackpots ORDER BY id_tipo")
-    tipo_stacker = query_todos("SELECT id_stacker, name_stacker FROM tipo_stacker ORDER BY id_stacker")
-    usuarios = query_todos("SELECT id_usuario, name_usuario, rol FROM usuarios ORDER BY name_usuario")
-    estados = query_todos("SELECT id_estado, estado FROM estado ORDER BY id_estado")
 
     return render_template(
         "configuracion.html",
@@ -542,6 +1522,10 @@ def api_config_create(resource):
     cols_sql = ",".join(cols)
     sql = f"INSERT INTO {spec['table']} ({cols_sql}) VALUES ({placeholders})"
     ok = exec_sql(sql, tuple(vals))
+    if ok:
+        invalidar_catalogos(spec["table"])
+        if resource in HOLD_RECURSOS:
+            hold_cache.invalidar()
     return jsonify(ok=bool(ok), msg="Creado" if ok else "Error al crear")
 
 
@@ -579,6 +1563,10 @@ def api_config_update(resource, id):
     sets_sql = ", ".join(sets)
     sql = f"UPDATE {spec['table']} SET {sets_sql} WHERE {spec['id']}=%s"
     ok = exec_sql(sql, tuple(params))
+    if ok:
+        invalidar_catalogos(spec["table"])
+        if resource in HOLD_RECURSOS:
+            hold_cache.invalidar()
     return jsonify(ok=bool(ok), msg="Actualizado" if ok else "Error al actualizar")
 
 
@@ -591,6 +1579,10 @@ def api_config_delete(resource, id):
         return jsonify(ok=False, msg="Recurso desconocido"), 404
     try:
         ok = exec_sql(f"DELETE FROM {spec['table']} WHERE {spec['id']}=%s", (id,))
+        if ok:
+            invalidar_catalogos(spec["table"])
+            if resource in HOLD_RECURSOS:
+                hold_cache.invalidar()
         return jsonify(ok=bool(ok), msg="Eliminado" if ok else "No eliminado")
     except Exception as e:
         print("DB error:", e)
@@ -641,7 +1633,17 @@ def cambio():
     )
 
 
+def _meses_tipo_cambio(row) -> set:
+    """{(anio, mes_num)} de una fila de tipo_cambio (vacío si el mes guardado no es reconocible)."""
+    mes = normaliza_mes_nombre(str(row.get("mes") or ""))
+    try:
+        return {(int(row["anio"]), MESES_NOMBRE.index(mes) + 1)} if mes else set()
+    except (TypeError, ValueError):
+        return set()
+
+
 @app.route('/api/tipo_cambio/<int:id_cambio>', methods=['GET'])
+@cache_http("tipo_cambio")
 def api_tipo_cambio_detalle(id_cambio):
     if not is_logged_in():
         return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
@@ -652,7 +1654,7 @@ def api_tipo_cambio_detalle(id_cambio):
     """, (id_cambio,))
     if not row:
         return jsonify({'ok': False, 'msg': 'No encontrado'}), 404
-    return jsonify(row)
+    return jsonify_comprimido(row)
 
 @app.route('/api/tipo_cambio', methods=['POST'])
 def api_tipo_cambio_crear():
@@ -686,6 +1688,9 @@ def api_tipo_cambio_crear():
         """,
         (anio, mes, valor),
     )
+    if ok:
+        invalidar_hold_meses({(anio, MESES_NOMBRE.index(mes) + 1)}, selectores=False)
+        olvidar_versiones()
     return (jsonify({'ok': True, 'id': last_id})
             if ok else (jsonify({'ok': False, 'msg': 'Error al crear'}), 500))
 
@@ -710,7 +1715,7 @@ def api_tipo_cambio_actualizar(id_cambio):
     if not mes:
         return jsonify({'ok': False, 'msg': 'Mes inválido. Usa Enero..Diciembre'}), 400
 
-    curr = query_uno("SELECT id_cambio FROM tipo_cambio WHERE id_cambio=%s", (id_cambio,))
+    curr = query_uno("SELECT id_cambio, anio, mes FROM tipo_cambio WHERE id_cambio=%s", (id_cambio,))
     if not curr:
         return jsonify({'ok': False, 'msg': 'No encontrado'}), 404
 
@@ -728,6 +1733,9 @@ def api_tipo_cambio_actualizar(id_cambio):
         WHERE id_cambio=%s
         RETURNING id_cambio
     """, (anio, mes, valor, id_cambio))
+    if ok:
+        invalidar_hold_meses(_meses_tipo_cambio(curr) | {(anio, MESES_NOMBRE.index(mes) + 1)}, selectores=False)
+        olvidar_versiones()
     return jsonify({'ok': bool(ok)})
 
 
@@ -738,106 +1746,87 @@ def api_tipo_cambio_eliminar(id_cambio):
         return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
     if not is_admin():
         return jsonify({'ok': False, 'msg': 'Solo Admin puede eliminar'}), 403
-    curr = query_uno("SELECT id_cambio FROM tipo_cambio WHERE id_cambio=%s", (id_cambio,))
+    curr = query_uno("SELECT id_cambio, anio, mes FROM tipo_cambio WHERE id_cambio=%s", (id_cambio,))
     if not curr:
         return jsonify({'ok': False, 'msg': 'No encontrado'}), 404
     ok, _ = exec_sql_returning("DELETE FROM tipo_cambio WHERE id_cambio=%s RETURNING id_cambio", (id_cambio,))
+    if ok:
+        invalidar_hold_meses(_meses_tipo_cambio(curr), selectores=False)
+        olvidar_versiones()
     return jsonify({'ok': bool(ok)})
 
 # --- Gastos ---
 
-@app.route('/gastos')
-def gastos():
-    if not is_logged_in():
-        return redirect(url_for('login'))
-
-    # Parámetros de filtro
+def _gastos_filtros():
+    """
+    Condiciones y parámetros de ?desde=/?hasta= (YYYY-MM-DD, inclusivos), ?anio=, ?mes= (nombre)
+    y ?modelo= para las consultas de gastos. Las fechas se filtran como rangos sobre g.fecha
+    para que se use el índice.
+    """
     anio = request.args.get('anio')        # '2025' o ''/None
     mes  = request.args.get('mes')         # 'Enero'..'Diciembre' o ''/None o 'Todos'
     modelo_id = request.args.get('modelo') # id_modelo o ''/None
+    desde = parse_date(request.args.get('desde'))
+    hasta = parse_date(request.args.get('hasta'))
 
-    # Catálogos para selects
-    modelos = query_todos("SELECT id_modelo, name_modelo FROM modelos ORDER BY name_modelo")
-    # Años existentes en gastos
-    anios = query_todos("""
-        SELECT DISTINCT EXTRACT(YEAR FROM fecha)::int AS anio
-        FROM gastos
-        ORDER BY anio DESC
-    """)
-    # --- Catálogo de meses para mapping nombre -> número ---
-    MESES_NOMBRE = [
-        "Enero","Febrero","Marzo","Abril","Mayo","Junio",
-        "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"
-    ]
-
-    # ------------------ Filtros ------------------
     where = []
     params = []
 
-    # Año
-    if anio:
-        where.append("EXTRACT(YEAR FROM g.fecha)::int = %s")
-        params.append(int(anio))
-
-    # Mes (nombre -> número)
+    # Mes (nombre -> número); si no mapea, simplemente no añadimos filtro de mes
+    mes_num = None
     if mes and mes != "Todos":
         mes_norm = (mes or "").strip().capitalize()
-        mes_num = None
-        try:
+        if mes_norm in MESES_NOMBRE:
             mes_num = MESES_NOMBRE.index(mes_norm) + 1  # 1..12
-        except ValueError:
-            mes_num = None
 
+    # Año (y mes) -> rango [inicio, fin)
+    if anio:
+        anio = int(anio)
         if mes_num:
-            where.append("EXTRACT(MONTH FROM g.fecha)::int = %s")
-            params.append(mes_num)
-        # si no mapea, simplemente no añadimos filtro de mes
+            inicio, fin = _rango_mes(anio, mes_num)
+        else:
+            inicio, fin = _rango_anio(anio)
+        where.append("g.fecha >= %s AND g.fecha < %s")
+        params += [inicio, fin]
+    elif mes_num:
+        # Un mes de cualquier año no es un rango único
+        where.append("EXTRACT(MONTH FROM g.fecha)::int = %s")
+        params.append(mes_num)
+
+    if desde:
+        where.append("g.fecha >= %s")
+        params.append(desde)
+    if hasta:
+        where.append("g.fecha < %s")
+        params.append(hasta + timedelta(days=1))
 
     # Modelo
     if modelo_id:
         where.append("mo.id_modelo = %s")
         params.append(int(modelo_id))
 
-    # ... código anterior para filtros ...
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    return where, params
 
-    # Consulta principal (tabla)
-    gastos_list = query_todos(f"""
-        SELECT
-        g.id_gasto,
-        g.fecha,
-        g.monto,
-        g.detalle,
-        m.id_maquina,
-        m.numero AS maquina_numero,
-        mo.id_modelo,
-        mo.name_modelo,
-        pr.name_proveedor
-        FROM gastos g
-        JOIN maquinas m  ON m.id_maquina = g.id_maquina
-        LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo
-        LEFT JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor
-        {where_sql}
-        ORDER BY g.fecha DESC, g.id_gasto DESC
-        LIMIT 5000
-    """, tuple(params))
 
-    #maquinas
-    maquinas = query_todos("SELECT id_maquina, numero FROM maquinas ORDER BY numero")
+@app.route('/gastos')
+@snapshot_lectura
+def gastos():
+    if not is_logged_in():
+        return redirect(url_for('login'))
 
-    # >>> NUEVO: total filtrado
-    total_gastos = query_valor(f"""
-        SELECT COALESCE(SUM(g.monto), 0)
-        FROM gastos g
-        JOIN maquinas m  ON m.id_maquina = g.id_maquina
-        LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo
-        {where_sql}
-    """, tuple(params)) or 0.0
+    anio = request.args.get('anio')
+    mes  = request.args.get('mes')
+    modelo_id = request.args.get('modelo')
+
+    # Modelos, años y máquinas desde la caché; las filas las pide la página por partes a /api/gastos
+    modelos, anios, maquinas = catalogos("modelos", "gastos_anios", "maquinas_numero")
 
     # Para selects (pre-selección)
     anio_sel = str(anio) if anio else ""
     mes_sel = mes if mes else ""
     modelo_sel = str(modelo_id) if modelo_id else ""
+    desde_sel = request.args.get('desde') or ""
+    hasta_sel = request.args.get('hasta') or ""
 
     return render_template(
         'gastos.html',
@@ -846,16 +1835,88 @@ def gastos():
         modelos=modelos,
         anios=[r['anio'] for r in anios],
         meses=MESES_NOMBRE,
-        gastos=gastos_list,
         anio_sel=anio_sel,
         mes_sel=mes_sel,
         modelo_sel=modelo_sel,
-        total_gastos=total_gastos,   # <<< pásalo al template
-        maquinas=maquinas
+        desde_sel=desde_sel,
+        hasta_sel=hasta_sel,
+        maquinas=maquinas,
+        gastos_pagina=GASTOS_PAGINA,
 )
 
 
+# Filas por página del listado de gastos (por defecto y máximo que se puede pedir con ?limit=)
+GASTOS_PAGINA = int(os.environ.get("GASTOS_PAGINA", "200"))
+GASTOS_PAGINA_MAX = 1000
+
+# Listado de gastos, del más reciente al más antiguo. {totales} agrega las columnas de ventana
+# con el conteo y la suma de todo lo filtrado (se calculan antes del LIMIT, en el mismo recorrido).
+SQL_GASTOS_LISTADO = """
+    SELECT
+      g.id_gasto,
+      TO_CHAR(g.fecha, 'YYYY-MM-DD') AS fecha,
+      g.monto,
+      g.detalle,
+      m.id_maquina,
+      m.numero AS maquina_numero,
+      mo.id_modelo,
+      mo.name_modelo,
+      pr.name_proveedor
+      {totales}
+    FROM gastos g
+    JOIN maquinas m  ON m.id_maquina = g.id_maquina
+    LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo
+    LEFT JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor
+    {where}
+    ORDER BY g.fecha DESC, g.id_gasto DESC
+    LIMIT %s
+"""
+
+
+@app.route('/api/gastos', methods=['GET'])
+@cache_http("gastos", "maquinas", "modelos", "proveedores")
+def api_gastos_listado():
+    """
+    Una página de gastos con los filtros de /gastos. La siguiente se pide con ?after_fecha=&after_id=
+    de 'next' (sin 'after_fecha' si la fecha es NULL, que van primero). 'registros' y 'total' (suma
+    de montos) de todo lo filtrado solo vienen en la primera.
+    """
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg':'No autenticado'}), 401
+
+    limite = min(max(request.args.get('limit', GASTOS_PAGINA, type=int), 1), GASTOS_PAGINA_MAX)
+    where, params = _gastos_filtros()
+    after_fecha = parse_date(request.args.get('after_fecha'))
+    after_id = request.args.get('after_id', type=int)
+
+    primera = after_id is None
+    if not primera:
+        if after_fecha is None:
+            where.append("((g.fecha IS NULL AND g.id_gasto < %s) OR g.fecha IS NOT NULL)")
+            params.append(after_id)
+        else:
+            where.append("(g.fecha, g.id_gasto) < (%s, %s)")
+            params += [after_fecha, after_id]
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    totales = ", COUNT(*) OVER () AS _registros, COALESCE(SUM(g.monto) OVER (), 0) AS _total" if primera else ""
+
+    # Se pide una fila de más para saber si hay otra página
+    filas = query_todos(SQL_GASTOS_LISTADO.format(totales=totales, where=where_sql), (*params, limite + 1))
+
+    registros = total = None
+    if primera:
+        registros, total = (filas[0]['_registros'], float(filas[0]['_total'])) if filas else (0, 0.0)
+        for f in filas:
+            del f['_registros'], f['_total']
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = {'after_fecha': filas[-1]['fecha'], 'after_id': filas[-1]['id_gasto']}
+    return jsonify_comprimido({'ok': True, 'items': filas, 'registros': registros, 'total': total, 'next': siguiente})
+
+
 @app.route('/api/gastos/<int:id_gasto>', methods=['GET'])
+@cache_http("gastos")
 def api_gasto_detalle(id_gasto):
     if not is_logged_in():
         return jsonify({'ok': False, 'msg':'No autenticado'}), 401
@@ -874,7 +1935,7 @@ def api_gasto_detalle(id_gasto):
     if not row:
         return jsonify({'ok': False, 'msg':'No encontrado'}), 404
 
-    return jsonify(row)
+    return jsonify_comprimido(row)
 
 
 @app.route('/api/gastos', methods=['POST'])
@@ -899,6 +1960,8 @@ def api_gasto_crear():
         VALUES (%s, %s, %s, %s)
         RETURNING id_gasto
     """, (int(maquina), detalle, fecha, monto))
+    if ok:
+        olvidar_versiones()
     return (jsonify({'ok': True, 'id': last_id})
             if ok else (jsonify({'ok': False, 'msg':'Error al crear'}), 500))
 
@@ -925,6 +1988,8 @@ def api_gasto_actualizar(id_gasto):
         WHERE id_gasto=%s
         RETURNING id_gasto
     """, (int(maquina), detalle, fecha, monto, id_gasto))
+    if ok:
+        olvidar_versiones()
     return jsonify({'ok': bool(ok)})
 
 @app.route('/api/gastos/<int:id_gasto>', methods=['DELETE'])
@@ -939,6 +2004,8 @@ def api_gasto_eliminar(id_gasto):
         "DELETE FROM gastos WHERE id_gasto=%s RETURNING id_gasto",
         (id_gasto,)
     )
+    if ok:
+        olvidar_versiones()
     return jsonify({'ok': bool(ok)})
 
 
@@ -946,79 +2013,693 @@ def api_gasto_eliminar(id_gasto):
 # --- HOLD ---
 
 
-@app.route('/api/hold/preview', methods=['POST'])
-def api_hold_preview():
-    if not is_logged_in():
-        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+# Columnas finales del reporte de hold (orden exacto esperado por la DB)
+HOLD_COLUMNAS = [
+    'maquina','jornada','jugado','ganado','bill','in_redimibles','promo_in_no_redimible','promo_redimible',
+    'out_redimible','promo_out_no_redimible','jackpot','salida_manual','total_in','total_out','total_re_in',
+    'total_re_out','jugadas','apuesta_media','jugadas_ganadas','promo_no_redimible'
+]
+# Filas tras el encabezado que no son datos (la siguiente es el encabezado real)
+HOLD_FILAS_DESCARTAR = 5
+# Columnas "Unnamed: x" (encabezado vacío) que sobran en el reporte, por posición en la hoja
+HOLD_COLUMNAS_DESCARTAR = {3, 7, 9, 19, 22, 26, 28, 29, 30, 31, 32}
+# Textos que pandas lee como vacíos; se aplican igual en la lectura por streaming
+_TEXTOS_NA = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
 
-    f = request.files.get('file')
-    if not f:
-        return jsonify({'ok': False, 'msg': 'Adjunta un archivo .xlsx/.xls'}), 400
 
-    filename = (f.filename or '').lower()
-    if not (filename.endswith('.xlsx') or filename.endswith('.xls')):
-        return jsonify({'ok': False, 'msg': 'Formato no admitido. Usa .xlsx o .xls'}), 400
+def _hold_celda(celda):
+    """Valor de una celda de openpyxl con las mismas conversiones que pandas.read_excel."""
+    v = celda.value
+    if v is None or celda.data_type == 'e':
+        return None
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and v in _TEXTOS_NA:
+        return None
+    return v
+
+
+def _hold_leer_xlsx(f):
+    """
+    Lee el reporte .xlsx fila a fila (openpyxl read_only) aplicando las reglas de la importación:
+    encabezado en la primera fila, se descartan las 5 siguientes, las 2 primeras columnas y las
+    "Unnamed" sobrantes; la fila siguiente da los nombres reales y se omiten filas sin Jornada/Máquina.
+    Devuelve (columnas, iterador de filas); la memoria no depende del tamaño del archivo.
+    El archivo queda a cargo del iterador, que lo cierra al terminar.
+    Lanza ValueError si la hoja no tiene la forma esperada.
+    """
+    from openpyxl import load_workbook
 
-    # Import local para evitar fallos si falta pandas en otros endpoints
     try:
-        import pandas as pd
+        wb = load_workbook(f, read_only=True, data_only=True)
     except Exception:
-        return jsonify({'ok': False, 'msg': 'Falta librería pandas en el servidor'}), 500
+        f.close()
+        raise
 
+    def cerrar():
+        wb.close()
+        f.close()
+
+    try:
+        filas = wb.active.iter_rows()
+
+        def siguiente(valor=_hold_celda):
+            fila = [valor(c) for c in next(filas)]
+            while fila and fila[-1] is None:
+                fila.pop()
+            return fila
+
+        # Encabezado de la hoja + filas descartadas + encabezado real: fijan el ancho de la tabla.
+        # En el encabezado solo la celda vacía cuenta como sin nombre ("Unnamed: x" en pandas).
+        cabecera = [siguiente(lambda c: None if c.value in (None, '') else c.value)]
+        cabecera += [siguiente() for _ in range(HOLD_FILAS_DESCARTAR + 1)]
+        ancho = max(len(r) for r in cabecera)
+        if ancho < 2:
+            raise ValueError("hoja sin columnas")
+        nombres = cabecera[0] + [None] * (ancho - len(cabecera[0]))
+        usadas = [i for i in range(2, ancho)
+                  if not (nombres[i] is None and i in HOLD_COLUMNAS_DESCARTAR)]
+        if len(usadas) != len(HOLD_COLUMNAS):
+            raise ValueError(f"se esperaban {len(HOLD_COLUMNAS)} columnas y hay {len(usadas)}")
+
+        encabezado = cabecera[-1] + [None] * (ancho - len(cabecera[-1]))
+        reales = [encabezado[i] for i in usadas]
+        obligatorias = [reales.index(n) for n in ('Jornada', 'Máquina') if n in reales]
+    except StopIteration:
+        cerrar()
+        raise ValueError("hoja sin encabezado")
+    except Exception:
+        cerrar()
+        raise
+
+    def generar():
+        try:
+            vacias = 0  # filas vacías pendientes: pandas descarta las del final de la hoja
+            for celdas in filas:
+                fila = [_hold_celda(c) for c in celdas]
+                while fila and fila[-1] is None:
+                    fila.pop()
+                if not fila:
+                    vacias += 1
+                    continue
+                extra = [i for i in range(ancho, len(fila))
+                         if fila[i] is not None and i not in HOLD_COLUMNAS_DESCARTAR]
+                if extra:
+                    raise ValueError(f"fila con datos fuera de la tabla (columna {extra[0] + 1})")
+                if vacias and not obligatorias:
+                    for _ in range(vacias):
+                        yield dict.fromkeys(HOLD_COLUMNAS)
+                vacias = 0
+                fila += [None] * (ancho - len(fila))
+                valores = [fila[i] for i in usadas]
+                if any(valores[i] is None for i in obligatorias):
+                    continue
+                yield dict(zip(HOLD_COLUMNAS, valores))
+        finally:
+            cerrar()
+
+    return HOLD_COLUMNAS, generar()
+
+
+def _hold_leer_pandas(f):
+    """Lectura completa con pandas; solo para .xls (xlrd no permite leer por streaming)."""
+    import pandas as pd
+
+    # .xls -> intenta inferir; si no, xlrd
+    try:
+        df = pd.read_excel(f)
+    except Exception:
+        df = pd.read_excel(f, engine='xlrd')
+
+    # 1) Eliminar filas 1..5 (índices 0..4)
+    df = df.drop(df.index[0:HOLD_FILAS_DESCARTAR])
+
+    # 2) Eliminar primeras 2 columnas por índice (si existen)
+    if df.shape[1] >= 2:
+        df = df.drop(df.columns[[0, 1]], axis=1)
+
+    # 2b) Eliminar columnas "Unnamed: x" específicas si existen
+    sobrantes = [f'Unnamed: {i}' for i in sorted(HOLD_COLUMNAS_DESCARTAR)]
+    df = df.drop(columns=[c for c in sobrantes if c in df.columns])
+
+    # 3) Primera fila como encabezado
+    df.columns = df.iloc[0]
+    df = df[1:].reset_index(drop=True)
+
+    # 4-5) Quitar filas en blanco en 'Jornada' y 'Máquina'
+    for col in ('Jornada', 'Máquina'):
+        if col in df.columns:
+            df = df[df[col].notna()]
+
+    # 6) Renombrar al conjunto final y 7) reemplazar NaN por None
+    df.columns = HOLD_COLUMNAS
+    df = df.where(df.notnull(), None)
+    return HOLD_COLUMNAS, df.to_dict(orient='records')
+
+
+# Lotes leídos en preview que esperan confirmación: un .jsonl.gz por token en HOLD_STAGING_DIR
+HOLD_STAGING_DIR = os.environ.get("HOLD_STAGING_DIR") or os.path.join(tempfile.gettempdir(), "maquinas_hold")
+HOLD_STAGING_TTL = float(os.environ.get("HOLD_STAGING_TTL", "3600"))
+# Filas por página de la vista previa (por defecto y máximo que se puede pedir con ?limit=)
+HOLD_PREVIEW_MUESTRA = int(os.environ.get("HOLD_PREVIEW_MUESTRA", "300"))
+HOLD_PREVIEW_LIMITE_MAX = 2000
+
+# Cada cuántas filas se informa el avance de una importación
+HOLD_AVANCE_FILAS = 5000
+
+_TOKEN_STAGING = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+# Lote reservado por hold_staging_reclamar: <token>.jsonl.gz.<pid>.<hilo>
+_LOTE_RESERVADO = re.compile(r"^(.+)\.jsonl\.gz\.(\d+)\.\d+$")
+
+
+def _hold_staging_ruta(token):
+    """Ruta del lote para el token, o None si el token no tiene el formato esperado."""
+    if not isinstance(token, str) or not _TOKEN_STAGING.match(token):
+        return None
+    return os.path.join(HOLD_STAGING_DIR, token + ".jsonl.gz")
+
+
+def _pid_vivo(pid: int) -> bool:
     try:
-        # Leer Excel con heurística de engine
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _hold_staging_limpiar():
+    """
+    Borra los lotes vencidos (y los que quedaron a medio escribir). Los reservados para una inserción
+    (y sus datos del archivo) no se tocan mientras viva el proceso que los reclamó.
+    """
+    limite = time.time() - HOLD_STAGING_TTL
+    try:
+        nombres = os.listdir(HOLD_STAGING_DIR)
+    except FileNotFoundError:
+        return
+    en_uso = set()
+    for nombre in nombres:
+        reservado = _LOTE_RESERVADO.match(nombre)
+        if reservado and _pid_vivo(int(reservado.group(2))):
+            en_uso.add(reservado.group(1))
+    for nombre in nombres:
+        if nombre.split(".", 1)[0] in en_uso:
+            continue
+        ruta = os.path.join(HOLD_STAGING_DIR, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _jornada_dt(jornada):
+    try:
+        return datetime.strptime(str(jornada).strip(), "%d/%m/%Y %H:%M")
+    except ValueError:
+        return None
+
+
+def _jornada_txt(dt):
+    return dt.strftime("%d/%m/%Y %H:%M") if dt else None
+
+
+# ================================================
+#  ARCHIVOS YA IMPORTADOS (hold_archivos)
+# ================================================
+# Si el archivo se vuelve a importar (forzar) queda registrada la última importación
+SQL_HOLD_ARCHIVO_REGISTRAR = """
+    INSERT INTO hold_archivos (sha256, nombre, filas, insertadas, jornada_desde, jornada_hasta)
+    VALUES (%s, %s, %s, %s, """ + SQL_JORNADA_TS + ", " + SQL_JORNADA_TS + """)
+    ON CONFLICT (sha256) DO UPDATE SET
+        nombre = EXCLUDED.nombre, filas = EXCLUDED.filas, insertadas = EXCLUDED.insertadas,
+        jornada_desde = EXCLUDED.jornada_desde, jornada_hasta = EXCLUDED.jornada_hasta, importado = now()
+"""
+
+SQL_HOLD_ARCHIVO_COLUMNAS = """
+    sha256, nombre, filas, insertadas, importado,
+    to_char(jornada_desde, 'DD/MM/YYYY HH24:MI') AS jornada_desde,
+    to_char(jornada_hasta, 'DD/MM/YYYY HH24:MI') AS jornada_hasta
+"""
+
+
+def _hold_sha256(f) -> str:
+    """Hash del contenido del archivo; lo deja otra vez al inicio para leerlo."""
+    h = hashlib.sha256()
+    for bloque in iter(partial(f.read, 1024 * 1024), b""):
+        h.update(bloque)
+    f.seek(0)
+    return h.hexdigest()
+
+
+def _hold_archivo_params(meta: dict, insertadas: int) -> tuple:
+    """Parámetros de SQL_HOLD_ARCHIVO_REGISTRAR. meta: {sha256, nombre, filas, jornada_desde, jornada_hasta}."""
+    return (meta["sha256"], meta.get("nombre"), meta.get("filas") or 0, insertadas,
+            meta.get("jornada_desde"), meta.get("jornada_hasta"))
+
+
+def hold_maquinas_cargadas(jornada) -> frozenset:
+    """Máquinas que ya tienen en datos exactamente esa jornada (la clave única maquina, jornada)."""
+    dt = _jornada_dt(jornada)
+    if dt is None:
+        return frozenset()
+    return frozenset(r["maquina"] for r in query_todos(
+        "SELECT maquina FROM datos WHERE jornada_ts = %s AND jornada = %s", (dt, str(jornada).strip())))
+
+
+def _hold_filtrar_importadas(filas, cargadas, resumen: dict):
+    """
+    Itera las filas saltando las que ya están cargadas: cargadas(jornada) da las máquinas que ya
+    tienen esa jornada (hold_maquinas_cargadas) y se consulta una vez por jornada distinta.
+    Sin 'cargadas' no se salta nada y los repetidos los descarta el ON CONFLICT al insertar.
+    Deja en resumen: ya_importadas, el rango de jornadas de todo el archivo (desde, hasta) y sus máquinas.
+    """
+    jornadas = {}  # texto de jornada -> (datetime, máquinas ya cargadas)
+    maquinas = set()
+    saltadas = 0
+    try:
+        for fila in filas:
+            jornada = fila.get("jornada")
+            maquina = fila.get("maquina")
+            maquina = str(maquina).strip() if maquina is not None else None
+            if maquina is not None:
+                maquinas.add(maquina)
+            conocida = jornadas.get(jornada)
+            if conocida is None:
+                dt = _jornada_dt(jornada)
+                conocida = jornadas[jornada] = (dt, cargadas(jornada) if cargadas and dt else frozenset())
+            if maquina in conocida[1]:
+                saltadas += 1
+                continue
+            yield fila
+    finally:
+        fechas = [dt for dt, _ in jornadas.values() if dt is not None]
+        resumen.update(ya_importadas=saltadas, desde=min(fechas, default=None), hasta=max(fechas, default=None),
+                       maquinas=maquinas)
+
+
+def hold_staging_guardar(filas, progreso=None, cargadas=None, meta=None, muestra_max=HOLD_PREVIEW_MUESTRA):
+    """
+    Guarda las filas leídas en un lote comprimido y devuelve (token, muestra, resumen).
+    Las filas se escriben según llegan: solo la muestra (las primeras muestra_max) queda en memoria.
+    progreso(fase, filas), opcional, se llama cada HOLD_AVANCE_FILAS filas.
+    Las filas cuya máquina y jornada ya están cargadas ('cargadas') no se guardan; se cuentan en resumen['ya_importadas'].
+    'meta' (sha256, nombre) se guarda junto al lote para registrar el archivo al insertarlo.
+    """
+    _hold_staging_limpiar()
+    os.makedirs(HOLD_STAGING_DIR, exist_ok=True)
+    token = secrets.token_urlsafe(24)
+    ruta = _hold_staging_ruta(token)
+    dumps = app.json.dumps
+
+    muestra = []
+    n = 0
+    archivo = {}
+    try:
+        with gzip.open(ruta + ".tmp", "wt", encoding="utf-8", compresslevel=1) as out:
+            for fila in _hold_filtrar_importadas(filas, cargadas, archivo):
+                out.write(dumps(fila))
+                out.write("\n")
+                n += 1
+                if progreso is not None and not n % HOLD_AVANCE_FILAS:
+                    progreso("parsing", n)
+                if len(muestra) < muestra_max:
+                    muestra.append(fila)
+        resumen = {
+            "filas": n,
+            "ya_importadas": archivo["ya_importadas"],
+            "maquinas": len(archivo["maquinas"]),
+            "jornada_desde": _jornada_txt(archivo["desde"]),
+            "jornada_hasta": _jornada_txt(archivo["hasta"]),
+        }
+        if meta:
+            with open(_hold_staging_meta_ruta(ruta), "w", encoding="utf-8") as out:
+                out.write(dumps({**meta, "total": n, "filas": n + resumen["ya_importadas"],
+                                 "jornada_desde": resumen["jornada_desde"],
+                                 "jornada_hasta": resumen["jornada_hasta"]}))
+        os.replace(ruta + ".tmp", ruta)
+    except BaseException:
+        if os.path.exists(ruta + ".tmp"):
+            os.remove(ruta + ".tmp")
+        raise
+
+    return token, muestra, resumen
+
+
+def hold_staging_reclamar(token):
+    """
+    Reserva el lote del token para una inserción (lo renombra, así un segundo intento con el
+    mismo token no lo reutiliza). Devuelve la ruta reservada o None si no existe o venció.
+    """
+    ruta = _hold_staging_ruta(token)
+    if not ruta:
+        return None
+    reservada = f"{ruta}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        if os.path.getmtime(ruta) < time.time() - HOLD_STAGING_TTL:
+            os.remove(ruta)
+            return None
+        os.rename(ruta, reservada)
+    except OSError:
+        return None
+    # rename conserva la fecha: se renueva para que el TTL cuente desde la reserva
+    for r in (reservada, _hold_staging_meta_ruta(ruta)):
+        try:
+            os.utime(r)
+        except FileNotFoundError:
+            pass
+    return reservada
+
+
+def hold_staging_devolver(reservada):
+    """Devuelve un lote reservado a su token para poder reintentar (si entretanto no se borró)."""
+    try:
+        os.replace(reservada, reservada.rsplit(".", 2)[0])
+    except FileNotFoundError:
+        pass
+
+
+def _hold_staging_meta_ruta(ruta):
+    """Ruta de los datos del archivo de un lote (sirve con la ruta original o la reservada)."""
+    return ruta.rsplit(".jsonl.gz", 1)[0] + ".meta.json"
+
+
+def hold_staging_meta(ruta):
+    """Datos del archivo guardados con el lote (sha256, nombre, filas, rango de jornadas) o None."""
+    try:
+        with open(_hold_staging_meta_ruta(ruta), encoding="utf-8") as fh:
+            return app.json.loads(fh.read())
+    except (OSError, ValueError):
+        return None
+
+
+def hold_staging_borrar(ruta):
+    """Borra un lote reservado y sus datos de archivo."""
+    for r in (ruta, _hold_staging_meta_ruta(ruta)):
+        try:
+            os.remove(r)
+        except FileNotFoundError:
+            pass
+
+
+def hold_staging_pagina(ruta, inicio: int, limite: int) -> list:
+    """Filas [inicio, inicio + limite) de un lote guardado (solo decodifica las de la página)."""
+    loads = app.json.loads
+    with gzip.open(ruta, "rt", encoding="utf-8") as fh:
+        return [loads(linea) for linea in islice(fh, inicio, inicio + limite)]
+
+
+def _hold_columnar(filas, columnas=HOLD_COLUMNAS) -> list:
+    """Filas (dicts) a columnas: una lista de valores por cada nombre de 'columnas'."""
+    return [[f.get(c) for f in filas] for c in columnas]
+
+
+def _hold_pagina_args():
+    """(página 1-based, filas por página) de ?page= y ?limit=."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', HOLD_PREVIEW_MUESTRA, type=int), 1), HOLD_PREVIEW_LIMITE_MAX)
+    return page, limit
+
+
+def _hold_forzar() -> bool:
+    """?forzar= o campo 'forzar' del formulario: volver a leer un archivo ya importado."""
+    return (request.values.get('forzar') or '').lower() in ('1', 'true', 'si', 'sí')
+
+
+def hold_staging_leer(ruta):
+    """Itera las filas de un lote guardado."""
+    loads = app.json.loads
+    with gzip.open(ruta, "rt", encoding="utf-8") as fh:
+        for linea in fh:
+            yield loads(linea)
+
+
+@app.route('/api/hold/preview', methods=['POST'])
+def api_hold_preview():
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+
+    f = request.files.get('file')
+    if not f:
+        return jsonify({'ok': False, 'msg': 'Adjunta un archivo .xlsx/.xls'}), 400
+
+    filename = (f.filename or '').lower()
+    if not (filename.endswith('.xlsx') or filename.endswith('.xls')):
+        return jsonify({'ok': False, 'msg': 'Formato no admitido. Usa .xlsx o .xls'}), 400
+
+    _, limit = _hold_pagina_args()
+    res, status = hold_preview(f, f.filename, limite=limit, forzar=_hold_forzar())
+    return jsonify_comprimido(res, status)
+
+
+@app.route('/api/hold/preview/<token>', methods=['GET'])
+def api_hold_preview_pagina(token):
+    """Otra página de un lote de la vista previa (?page=&limit=), en el mismo formato por columnas."""
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+
+    ruta = _hold_staging_ruta(token)
+    meta = hold_staging_meta(ruta) if ruta else None
+    if not meta or not os.path.exists(ruta):
+        return jsonify({'ok': False, 'msg': 'La carga expiró o ya se insertó; vuelve a subir el archivo'}), 410
+
+    page, limit = _hold_pagina_args()
+    filas = hold_staging_pagina(ruta, (page - 1) * limit, limit)
+    return jsonify_comprimido({
+        'ok': True,
+        'columns': HOLD_COLUMNAS,
+        'values': _hold_columnar(filas),
+        'page': page,
+        'limit': limit,
+        'pages': -(-meta['total'] // limit),
+        'total': meta['total'],
+    })
+
+
+def hold_preview(f, nombre: str, progreso=None, limite: int = HOLD_PREVIEW_MUESTRA, forzar: bool = False) -> tuple:
+    """
+    Lee el reporte y lo guarda como lote. Devuelve (respuesta de /api/hold/preview, status HTTP).
+    La respuesta trae la primera página (limite filas) por columnas: 'columns' una vez y en 'values'
+    una lista de valores por columna; el resto se pide con /api/hold/preview/<token>?page=.
+    Si el mismo contenido ya se importó no se lee: responde ya_importado con lo que se cargó entonces,
+    salvo con forzar (p. ej. si se borraron sus filas de datos y hay que volver a cargarlas).
+    """
+    if progreso is not None:
+        progreso("parsing", 0)
+    filename = (nombre or '').lower()
+    try:
+        sha = _hold_sha256(f)
+        previo = None if forzar else query_uno(
+            "SELECT " + SQL_HOLD_ARCHIVO_COLUMNAS + " FROM hold_archivos WHERE sha256 = %s", (sha,))
+        if previo:
+            return {
+                'ok': True,
+                'ya_importado': True,
+                'importado': previo,
+                'token': None,
+                'columns': HOLD_COLUMNAS,
+                'values': [[] for _ in HOLD_COLUMNAS],
+                'page': 1,
+                'limit': limite,
+                'pages': 0,
+                'total': 0,
+                'resumen': {'filas': 0, 'ya_importadas': previo['filas'],
+                            'jornada_desde': previo['jornada_desde'], 'jornada_hasta': previo['jornada_hasta']},
+            }, 200
+
         if filename.endswith('.xlsx'):
-            df = pd.read_excel(f, engine='openpyxl')
+            # Lectura por streaming: memoria acotada aunque el reporte sea grande
+            columnas, filas = _hold_leer_xlsx(f)
         else:
-            # .xls -> intenta inferir; si no, xlrd
-            try:
-                df = pd.read_excel(f)
-            except Exception:
-                df = pd.read_excel(f, engine='xlrd')
-
-        # 1) Eliminar filas 1..5 (índices 0..4). Ajusta si tu archivo tiene otro offset.
-        df = df.drop(df.index[0:5])
-
-        # 2) Eliminar primeras 2 columnas por índice (si existen)
-        if df.shape[1] >= 2:
-            df = df.drop(df.columns[[0, 1]], axis=1)
-
-        # 2b) Eliminar columnas "Unnamed: x" específicas si existen
-        for col in ['Unnamed: 3','Unnamed: 7','Unnamed: 9','Unnamed: 19','Unnamed: 22',
-                    'Unnamed: 26','Unnamed: 28','Unnamed: 29','Unnamed: 30','Unnamed: 31','Unnamed: 32']:
-            if col in df.columns:
-                df = df.drop(columns=[col], axis=1)
-
-        # 3) Primera fila como encabezado
-        df.columns = df.iloc[0]
-        df = df[1:].reset_index(drop=True)
-
-        # 4) Quitar filas en blanco columna 'Jornada'
-        if 'Jornada' in df.columns:
-            df = df[df['Jornada'].notna()]
-
-        # 5) Quitar filas en blanco columna 'Máquina'
-        if 'Máquina' in df.columns:
-            df = df[df['Máquina'].notna()]
-
-        # 6) Renombrar columnas al conjunto final (orden exacto esperado por tu DB)
-        #    Asegúrate de que el número de columnas coincida; si no, revisa tu plantilla Excel.
-        df.columns = [
-            'maquina','jornada','jugado','ganado','bill','in_redimibles','promo_in_no_redimible','promo_redimible',
-            'out_redimible','promo_out_no_redimible','jackpot','salida_manual','total_in','total_out','total_re_in',
-            'total_re_out','jugadas','apuesta_media','jugadas_ganadas','promo_no_redimible'
-        ]
-
-        # 7) Reemplazar NaN por None
-        df = df.where(df.notnull(), None)
-
-        # Devolver preview
-        rows = df.to_dict(orient='records')
-        cols = list(df.columns)
-        return jsonify({'ok': True, 'columns': cols, 'rows': rows})
+            columnas, filas = _hold_leer_pandas(f)
+        # Las filas van directo al lote del servidor; al navegador solo vuelve una muestra.
+        # Se omiten las que ya están en datos (misma máquina y jornada).
+        meta = {'sha256': sha, 'nombre': nombre}
+        token, muestra, resumen = hold_staging_guardar(filas, progreso, hold_maquinas_cargadas, meta, limite)
+        if not resumen['filas'] and resumen['ya_importadas']:
+            # Todo el contenido ya estaba: se registra el archivo para no volver a leerlo
+            exec_sql(SQL_HOLD_ARCHIVO_REGISTRAR, _hold_archivo_params(hold_staging_meta(_hold_staging_ruta(token)), 0))
+    except ImportError as e:
+        return {'ok': False, 'msg': f'Falta librería {e.name} en el servidor'}, 500
     except Exception as e:
         print("preview error:", e)
-        return jsonify({'ok': False, 'msg': 'Error procesando el Excel'}), 500
+        return {'ok': False, 'msg': 'Error procesando el Excel'}, 500
+
+    return {
+        'ok': True,
+        'token': token,
+        'columns': columnas,
+        'values': _hold_columnar(muestra, columnas),
+        'page': 1,
+        'limit': limite,
+        'pages': -(-resumen['filas'] // limite),
+        'total': resumen['filas'],
+        'resumen': resumen,
+        'expira_en': int(HOLD_STAGING_TTL),
+    }, 200
+
+
+# Columnas de datos que llegan del reporte (en el orden de HOLD_COLUMNAS) y su tipo en la carga
+HOLD_COLUMNAS_DB = [
+    ("maquina", "text"), ("jornada", "text"), ("jugado", "numeric"), ("ganado", "numeric"),
+    ("bill", "bigint"), ("in_redimible", "bigint"), ("promo_in_no_redimible", "bigint"),
+    ("promo_redimible", "numeric"), ("out_redimible", "numeric"), ("promo_out_no_redimible", "numeric"),
+    ("jackpot", "numeric"), ("salida_manual", "numeric"), ("total_in", "numeric"), ("total_out", "numeric"),
+    ("total_re_in", "numeric"), ("total_re_out", "numeric"), ("jugadas", "bigint"), ("apuesta_media", "numeric"),
+    ("jugadas_ganadas", "bigint"), ("promo_no_redimible", "bigint"),
+]
+_HOLD_COLS_SQL = ", ".join(c for c, _ in HOLD_COLUMNAS_DB)
+
+# Pasa las filas de hold_staging a datos (omitiendo las ya importadas) y actualiza el resumen diario,
+# todo en una sentencia. Devuelve las filas insertadas y los meses tocados.
+SQL_HOLD_CARGAR = """
+    WITH ins AS (
+        INSERT INTO datos (""" + _HOLD_COLS_SQL + """, jornada_ts, maquina_norm)
+        SELECT """ + _HOLD_COLS_SQL + ", " + (SQL_JORNADA_TS % "jornada") + ", " + (SQL_MAQUINA_NORM % "maquina") + """
+        FROM hold_staging
+        ON CONFLICT (maquina, jornada) DO NOTHING
+        RETURNING maquina, maquina_norm, jornada_ts, total_in, total_out, jugado
+    ),
+    resumen AS (""" + SQL_DIARIO_UPSERT.format(origen="ins", filtro="") + """
+        RETURNING dia
+    ),
+    periodos AS (
+        INSERT INTO datos_periodos (dia)
+        SELECT DISTINCT dia FROM resumen
+        ON CONFLICT DO NOTHING
+    )
+    SELECT (SELECT COUNT(*) FROM ins),
+           (SELECT array_agg(DISTINCT date_trunc('month', dia)::date) FROM resumen)
+"""
+
+
+# Filas que se normalizan de una vez (acota la memoria con lotes grandes)
+HOLD_NORMALIZAR_LOTE = int(os.environ.get("HOLD_NORMALIZAR_LOTE", "50000"))
+# Rechazos que se detallan en la respuesta (el total siempre se informa)
+HOLD_RECHAZOS_MAX = 100
+
+
+def _hold_numeros(columna: pd.Series, entero: bool) -> tuple:
+    """
+    Convierte una columna completa a valores para COPY (None = NULL): acepta números y textos
+    numéricos, quita el separador de miles, trunca los enteros y deja NULL lo no numérico o no finito.
+    Devuelve (valores, fuera de rango): la máscara marca los enteros que no caben en un bigint,
+    que quedan en NULL y cuya fila se debe rechazar.
+    """
+    num = pd.to_numeric(columna, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    if columna.dtype == object:
+        # Solo lo que no se pudo convertir pasa por el camino lento (textos con separador de miles)
+        pendientes = np.isnan(num) & columna.notna().to_numpy()
+        if pendientes.any():
+            num[pendientes] = pd.to_numeric(
+                columna[pendientes].astype(str).str.replace(",", "", regex=False), errors="coerce"
+            ).to_numpy(dtype="float64", na_value=np.nan)
+    if pd.api.types.infer_dtype(columna, skipna=True) not in ("integer", "floating", "mixed-integer-float", "empty"):
+        # Verdadero/Falso no son cantidades (to_numeric los tomaría como 1/0)
+        num[columna.map(lambda v: isinstance(v, (bool, np.bool_))).to_numpy(dtype=bool)] = np.nan
+
+    ok = np.isfinite(num)
+    fuera = np.zeros(len(num), dtype=bool)
+    if entero:
+        # astype(int64) daría la vuelta sin error fuera de [-2**63, 2**63)
+        fuera[ok] = np.abs(num[ok]) >= 2.0 ** 63
+        ok &= ~fuera
+    valores = (np.trunc(num[ok]).astype(np.int64) if entero else num[ok]).astype(object)
+    salida = np.full(len(num), None, dtype=object)
+    salida[ok] = valores
+    return salida.tolist(), fuera
+
+
+def _hold_normalizar(filas, buffer_csv, progreso=None) -> tuple:
+    """
+    Normaliza las filas del reporte por columnas (pandas/NumPy) y las escribe en buffer_csv con el
+    formato que espera _hold_cargar: texto sin espacios, números sin separador de miles, enteros
+    truncados y vacío/no numérico -> NULL. Las filas sin máquina o jornada se rechazan, y también
+    las de jornada que no es una fecha 'DD/MM/YYYY HH:MM' válida (la carga la convierte a timestamp)
+    y las que traen un entero que no cabe en un bigint.
+    Devuelve (filas válidas, filas rechazadas, detalle de las primeras HOLD_RECHAZOS_MAX como
+    {fila, motivo}, con fila = posición 1-based en el lote).
+    """
+    writer = csv.writer(buffer_csv)
+    validas = 0
+    rechazadas = 0
+    rechazos = []
+    inicio = 0
+    filas = iter(filas)
+    while True:
+        bloque = list(islice(filas, HOLD_NORMALIZAR_LOTE))
+        if not bloque:
+            break
+        df = pd.DataFrame.from_records(bloque, columns=HOLD_COLUMNAS)
+        del bloque
+
+        columnas = []
+        fuera_de_rango = np.zeros(len(df), dtype=bool)
+        columna_fuera = np.full(len(df), None, dtype=object)  # primera columna fuera de rango de cada fila
+        for (c, tipo), origen in zip(HOLD_COLUMNAS_DB, HOLD_COLUMNAS):  # in_redimibles -> in_redimible
+            if tipo == "text":
+                texto = df[origen].astype("string").str.strip()
+                vacio = (texto.fillna("") == "").to_numpy(dtype=bool)
+                columnas.append(texto.astype(object).where(~vacio, None))
+            else:
+                valores, fuera = _hold_numeros(df[origen], entero=(tipo == "bigint"))
+                columnas.append(valores)
+                columna_fuera[fuera & ~fuera_de_rango] = origen
+                fuera_de_rango |= fuera
+
+        sin_maquina = columnas[0].isna().to_numpy()
+        sin_jornada = columnas[1].isna().to_numpy()
+        jornada_invalida = ~sin_jornada & pd.to_datetime(
+            columnas[1], format="%d/%m/%Y %H:%M", errors="coerce").isna().to_numpy()
+        malas = sin_maquina | sin_jornada | jornada_invalida | fuera_de_rango
+        if malas.any():
+            rechazadas += int(malas.sum())
+            for i in np.flatnonzero(malas)[:max(HOLD_RECHAZOS_MAX - len(rechazos), 0)]:
+                sm, sj = sin_maquina[i], sin_jornada[i]
+                if jornada_invalida[i]:
+                    motivo = "Jornada inválida"
+                elif fuera_de_rango[i] and not (sm or sj):
+                    motivo = f"Valor fuera de rango en {columna_fuera[i]}"
+                else:
+                    motivo = "Sin máquina ni jornada" if sm and sj else ("Sin máquina" if sm else "Sin jornada")
+                rechazos.append({"fila": inicio + int(i) + 1, "motivo": motivo})
+        inicio += len(df)
+
+        columnas[0] = columnas[0].tolist()
+        columnas[1] = columnas[1].tolist()
+        buenas = np.flatnonzero(~malas)
+        if len(buenas) == len(malas):
+            writer.writerows(zip(*columnas))
+        else:
+            writer.writerows(zip(*([col[i] for i in buenas] for col in columnas)))
+        validas += len(buenas)
+        if progreso is not None:
+            progreso("validating", inicio)
+    return validas, rechazadas, rechazos
+
+
+def _hold_cargar(cur, buffer_csv) -> tuple:
+    """
+    Carga con COPY un CSV (columnas de HOLD_COLUMNAS_DB, vacío = NULL) en una tabla temporal y lo
+    pasa a datos con ON CONFLICT (maquina, jornada) DO NOTHING. Usa la transacción del cursor.
+    Devuelve (insertadas, {(anio, mes)} afectados).
+    """
+    # Se puede llamar varias veces en la misma transacción (importación por lotes)
+    cur.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS hold_staging ("
+        + ", ".join(f"{c} {t}" for c, t in HOLD_COLUMNAS_DB)
+        + ") ON COMMIT DROP"
+    )
+    cur.execute("TRUNCATE hold_staging")
+    cur.copy_expert(f"COPY hold_staging ({_HOLD_COLS_SQL}) FROM STDIN WITH (FORMAT csv)", buffer_csv)
+    cur.execute(SQL_HOLD_CARGAR)
+    insertadas, meses = cur.fetchone()
+    return insertadas, {(m.year, m.month) for m in (meses or [])}
 
 
 # ================================================
@@ -1034,101 +2715,478 @@ def api_hold_insert():
         return jsonify({'ok': False, 'msg': 'Solo Admin puede insertar'}), 403
 
     data = request.get_json(silent=True) or {}
-    rows = data.get('rows') or []
-    if not rows:
-        return jsonify({'ok': False, 'msg': 'No hay datos para insertar'}), 400
+    lote = None
+    if data.get('token'):
+        # Lote guardado por /api/hold/preview
+        lote = hold_staging_reclamar(data['token'])
+        if not lote:
+            return jsonify({'ok': False, 'msg': 'La carga expiró o ya se insertó; vuelve a subir el archivo'}), 410
+        rows = hold_staging_leer(lote)
+    else:
+        rows = data.get('rows') or []
+        if not rows:
+            return jsonify({'ok': False, 'msg': 'No hay datos para insertar'}), 400
+
+    res, status = hold_insertar(rows, lote)
+    return jsonify(res), status
+
+
+def hold_insertar(rows, lote: str = None, progreso=None) -> tuple:
+    """
+    Normaliza y carga las filas (las del lote reservado si viene 'lote').
+    Devuelve (respuesta de /api/hold/insert, status HTTP).
+    """
+    pool = obtener_pool()
+    conn = None
+    # CSV para COPY (vacío = NULL); pasa a disco si el lote es grande
+    buffer_csv = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='w+', newline='')
+    try:
+        if progreso is not None:
+            progreso("validating", 0)
+        # Normalización por columnas directo al CSV de la carga
+        validas, skipped, rechazos = _hold_normalizar(rows, buffer_csv, progreso)
+        detalle = {'rejected': skipped, 'rechazos': rechazos}
+
+        if not validas:
+            if lote:
+                hold_staging_borrar(lote)
+            return {'ok': True, 'inserted': 0, 'skipped': skipped, 'duplicados': 0, **detalle}, 200
+
+        # COPY + INSERT ... ON CONFLICT: los duplicados los descarta la BD (clave única maquina, jornada)
+        buffer_csv.seek(0)
+        if progreso is not None:
+            progreso("loading", validas)
+        meta = hold_staging_meta(lote) if lote else None
+        # Dentro del try: si el pool falla, el lote también se devuelve para reintentar
+        conn = pool.obtener()
+        with conn:
+            with conn.cursor() as cur:
+                inserted, meses = _hold_cargar(cur, buffer_csv)
+                if meta and meta.get('sha256'):
+                    cur.execute(SQL_HOLD_ARCHIVO_REGISTRAR, _hold_archivo_params(meta, inserted))
 
-    # Normalizadores
-    def numf(x):
-        if x in (None, '', 'NaN'):
-            return None
-        try:
-            return float(str(x).replace(',', ''))
-        except Exception:
-            return None
+        invalidar_hold_meses(meses)
+        olvidar_versiones()
+        if lote:
+            hold_staging_borrar(lote)
+        return {'ok': True, 'inserted': inserted, 'skipped': skipped + validas - inserted,
+                'duplicados': validas - inserted, **detalle}, 200
 
-    def numi(x):
-        if x in (None, '', 'NaN'):
-            return None
-        try:
-            return int(float(str(x).replace(',', '')))
-        except Exception:
-            return None
+    except Exception as e:
+        print("insert error:", e)
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        if lote:
+            # Se devuelve el lote para poder reintentar con el mismo token
+            hold_staging_devolver(lote)
+        return {'ok': False, 'msg': 'Error al insertar'}, 500
+    finally:
+        buffer_csv.close()
+        if conn is not None:
+            pool.devolver(conn)
 
-    def strn(x):
-        x = (x or '').strip()
-        return x or None
 
-    conn = conectar_db()
+# ================================================
+#  IMPORTACIÓN POR LOTES: varios archivos (o un .zip)
+# ================================================
+# Procesos que leen archivos en paralelo
+HOLD_LOTE_PROCESOS = int(os.environ.get("HOLD_LOTE_PROCESOS", str(min(4, os.cpu_count() or 1))))
+
+
+def _hold_procesar_archivo(nombre: str, ruta: str) -> dict:
+    """
+    Lee y normaliza un reporte con las mismas reglas que /api/hold/preview e /insert, dejando el CSV
+    para COPY en ruta + '.csv'. Corre en un proceso del pool: no toca la base de datos, así que las filas
+    ya cargadas no se saltan aquí sino en el ON CONFLICT de _hold_cargar (cuentan como duplicadas).
+    """
+    archivo = {}
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT maquina, jornada FROM datos")
-            existentes = set((m or '', j or '') for (m, j) in cur.fetchall())
+        if nombre.lower().endswith('.xlsx'):
+            _, filas = _hold_leer_xlsx(open(ruta, 'rb'))
+        else:
+            _, filas = _hold_leer_pandas(ruta)
+        with open(ruta + '.csv', 'w', newline='') as buffer_csv:
+            validas, rechazadas, rechazos = _hold_normalizar(
+                _hold_filtrar_importadas(filas, None, archivo), buffer_csv)
+    except Exception as e:
+        print("lote error:", nombre, e)
+        return {'archivo': nombre, 'ok': False, 'msg': 'Error procesando el Excel'}
+    return {'archivo': nombre, 'ok': True, 'csv': ruta + '.csv', 'validas': validas,
+            'rejected': rechazadas, 'rechazos': rechazos,
+            'filas': validas + rechazadas,
+            'jornada_desde': _jornada_txt(archivo['desde']), 'jornada_hasta': _jornada_txt(archivo['hasta'])}
 
-        values = []
-        skipped = 0
 
-        for r in rows:
-            maquina = strn(r.get('maquina'))
-            jornada = strn(r.get('jornada'))
-            if not (maquina and jornada):
-                skipped += 1
-                continue
-            key = (maquina, jornada)
-            if key in existentes:
-                skipped += 1
-                continue
+def _hold_expandir_archivos(archivos, destino: str) -> list:
+    """
+    Copia a 'destino' los .xlsx/.xls recibidos, abriendo los .zip. archivos: [(nombre, objeto archivo)].
+    Devuelve [(nombre, ruta, sha256)] en el orden recibido; lo que no es Excel se ignora.
+    """
+    rutas = []
+
+    def guardar(nombre, origen):
+        ruta = os.path.join(destino, f"{len(rutas):04d}{os.path.splitext(nombre)[1].lower()}")
+        h = hashlib.sha256()
+        with open(ruta, 'wb') as out:
+            for bloque in iter(partial(origen.read, 1024 * 1024), b""):
+                h.update(bloque)
+                out.write(bloque)
+        rutas.append((nombre, ruta, h.hexdigest()))
+
+    for nombre, fh in archivos:
+        nombre = os.path.basename(nombre or '')
+        bajo = nombre.lower()
+        if bajo.endswith('.zip'):
+            with zipfile.ZipFile(fh) as z:
+                for info in sorted(z.infolist(), key=lambda i: i.filename):
+                    interno = os.path.basename(info.filename)
+                    if not info.is_dir() and interno.lower().endswith(('.xlsx', '.xls')) and not interno.startswith('~$'):
+                        with z.open(info) as origen:
+                            guardar(f"{nombre}/{interno}", origen)
+        elif bajo.endswith(('.xlsx', '.xls')):
+            guardar(nombre, fh)
+    return rutas
+
+
+def importar_hold_lote(archivos, procesos: int = None, forzar: bool = False) -> dict:
+    """
+    Importa varios reportes: los lee en paralelo (ProcessPoolExecutor) y los carga todos en una sola
+    transacción, archivo por archivo y en el orden recibido, con estadísticas por archivo.
+    archivos: [(nombre, objeto archivo)], admite .zip. Si falla la carga no se inserta nada.
+    Los archivos cuyo contenido ya se importó (salvo con forzar) o que vienen repetidos no se leen;
+    de los demás, las filas (máquina, jornada) ya cargadas las descarta el ON CONFLICT y se informan
+    como duplicadas.
+    """
+    procesos = max(1, procesos or HOLD_LOTE_PROCESOS)
+    with tempfile.TemporaryDirectory(prefix="hold_lote_") as destino:
+        rutas = _hold_expandir_archivos(archivos, destino)
+        if not rutas:
+            return {'ok': False, 'msg': 'No se recibieron archivos .xlsx/.xls'}
+
+        previos = {} if forzar else {r['sha256']: r for r in query_todos(
+            "SELECT " + SQL_HOLD_ARCHIVO_COLUMNAS + " FROM hold_archivos WHERE sha256 = ANY(%s)",
+            ([sha for _, _, sha in rutas],))}
+        resultados = [None] * len(rutas)
+        pendientes = []
+        for i, (nombre, ruta, sha) in enumerate(rutas):
+            if sha in previos:
+                resultados[i] = {'archivo': nombre, 'ok': True, 'ya_importado': True, 'importado': previos[sha],
+                                 'inserted': 0, 'duplicados': 0, 'rejected': 0, 'rechazos': [], 'skipped': 0}
+                if previos[sha] is None:
+                    resultados[i]['msg'] = 'Repetido en el lote'
+            else:
+                previos[sha] = None  # Si viene repetido en el mismo lote se carga una sola vez
+                pendientes.append(i)
+
+        nombres = [rutas[i][0] for i in pendientes]
+        archivos_pendientes = [rutas[i][1] for i in pendientes]
+        if len(pendientes) <= 1 or procesos == 1:
+            leidos = list(map(_hold_procesar_archivo, nombres, archivos_pendientes))
+        else:
+            # spawn: los procesos hijos no heredan las conexiones ni los hilos del worker web
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(procesos, len(pendientes)), mp_context=ctx) as ejecutor:
+                leidos = list(ejecutor.map(_hold_procesar_archivo, nombres, archivos_pendientes))
+        for i, res in zip(pendientes, leidos):
+            res['sha256'] = rutas[i][2]
+            resultados[i] = res
+
+        meses = set()
+        with conexion_db() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    for res in resultados:
+                        if not res['ok'] or res.get('ya_importado'):
+                            continue
+                        if res['validas']:
+                            with open(res['csv'], newline='') as buffer_csv:
+                                insertadas, meses_archivo = _hold_cargar(cur, buffer_csv)
+                            meses |= meses_archivo
+                        else:
+                            insertadas = 0
+                        cur.execute(SQL_HOLD_ARCHIVO_REGISTRAR, _hold_archivo_params({**res, 'nombre': res['archivo']}, insertadas))
+                        res['inserted'] = insertadas
+                        res['duplicados'] = res['validas'] - insertadas
+                        res['skipped'] = res['duplicados'] + res['rejected']
+
+    invalidar_hold_meses(meses)
+    olvidar_versiones()
+    for res in resultados:
+        for k in ('csv', 'validas', 'sha256', 'filas', 'jornada_desde', 'jornada_hasta'):
+            res.pop(k, None)
+    return {
+        'ok': True,
+        'inserted': sum(r.get('inserted', 0) for r in resultados),
+        'skipped': sum(r.get('skipped', 0) for r in resultados),
+        'errores': sum(1 for r in resultados if not r['ok']),
+        'archivos': resultados,
+    }
 
-            values.append((
-                maquina,
-                jornada,
-                numf(r.get('jugado')),
-                numf(r.get('ganado')),
-                numi(r.get('bill')),
-                numi(r.get('in_redimibles')),      # DF plural -> DB singular
-                numi(r.get('promo_in_no_redimible')),
-                numf(r.get('promo_redimible')),
-                numf(r.get('out_redimible')),
-                numf(r.get('promo_out_no_redimible')),
-                numf(r.get('jackpot')),
-                numf(r.get('salida_manual')),
-                numf(r.get('total_in')),
-                numf(r.get('total_out')),
-                numf(r.get('total_re_in')),
-                numf(r.get('total_re_out')),
-                numi(r.get('jugadas')),
-                numf(r.get('apuesta_media')),
-                numi(r.get('jugadas_ganadas')),
-                numi(r.get('promo_no_redimible')),
-            ))
-
-        if not values:
-            return jsonify({'ok': True, 'inserted': 0, 'skipped': skipped})
-
-        from psycopg2.extras import execute_values
-        sql = """
-          INSERT INTO datos
-          (maquina, jornada, jugado, ganado, bill, in_redimible, promo_in_no_redimible,
-           promo_redimible, out_redimible, promo_out_no_redimible, jackpot, salida_manual,
-           total_in, total_out, total_re_in, total_re_out, jugadas, apuesta_media,
-           jugadas_ganadas, promo_no_redimible)
-          VALUES %s
-        """
-        with conn:
-            with conn.cursor() as cur:
-                execute_values(cur, sql, values, page_size=1000)
 
-        return jsonify({'ok': True, 'inserted': len(values), 'skipped': skipped})
+@app.route('/api/hold/lote', methods=['POST'])
+def api_hold_lote():
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+    if session.get('rol') != 'Admin':
+        return jsonify({'ok': False, 'msg': 'Solo Admin puede insertar'}), 403
 
+    archivos = [(f.filename, f) for f in request.files.getlist('files') + request.files.getlist('file')]
+    if not archivos:
+        return jsonify({'ok': False, 'msg': 'Adjunta archivos .xlsx/.xls o un .zip'}), 400
+    try:
+        res = importar_hold_lote(archivos, forzar=_hold_forzar())
     except Exception as e:
-        print("insert error:", e)
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        return jsonify({'ok': False, 'msg': 'Error al insertar'}), 500
+        print("lote error:", e)
+        return jsonify({'ok': False, 'msg': 'Error al importar el lote'}), 500
+    return jsonify(res), (200 if res['ok'] else 400)
+
+
+@app.cli.command("importar-hold")
+@click.argument("archivos", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--procesos", type=int, default=None, help="Procesos para leer en paralelo")
+@click.option("--forzar", is_flag=True, help="Lee también los archivos ya importados")
+def importar_hold_cmd(archivos, procesos, forzar):
+    """Importa reportes de hold (.xlsx/.xls o .zip) en una sola transacción."""
+    abiertos = [open(a, 'rb') for a in archivos]
+    try:
+        res = importar_hold_lote([(a, fh) for a, fh in zip(archivos, abiertos)], procesos, forzar)
     finally:
-        conn.close()
+        for fh in abiertos:
+            fh.close()
+    if not res['ok']:
+        raise click.ClickException(res['msg'])
+    for r in res['archivos']:
+        if r.get('ya_importado'):
+            print(f"{r['archivo']}: " + (r.get('msg') or f"ya importado el {r['importado']['importado']:%d/%m/%Y %H:%M}"))
+        elif r['ok']:
+            print(f"{r['archivo']}: insertadas {r['inserted']}, duplicadas {r['duplicados']}, "
+                  f"rechazadas {r['rejected']}")
+        else:
+            print(f"{r['archivo']}: ERROR {r['msg']}")
+    print(f"Total: insertadas {res['inserted']}, omitidas {res['skipped']}, archivos con error {res['errores']}")
+
+
+# ================================================
+#  IMPORTACIONES EN SEGUNDO PLANO (hold_jobs)
+# ================================================
+# El request solo guarda el archivo y encola el trabajo; un hilo local lo procesa y deja el avance
+# en hold_jobs, así cualquier worker web puede responder /api/hold/jobs/<id>.
+HOLD_JOBS_HILOS = int(os.environ.get("HOLD_JOBS_HILOS", "1"))
+# Cada cuánto (segundos) como máximo se escribe el avance en la tabla
+HOLD_JOBS_AVANCE_SEG = 1.0
+# Mientras un worker tiene trabajos (en cola o corriendo) marca su latido cada HOLD_JOBS_LATIDO_SEG;
+# uno sin latido en HOLD_JOBS_TIMEOUT se da por interrumpido (p. ej. se reinició el worker)
+HOLD_JOBS_LATIDO_SEG = 15.0
+HOLD_JOBS_TIMEOUT = int(os.environ.get("HOLD_JOBS_TIMEOUT", "120"))
+HOLD_JOBS_RETENCION_DIAS = 7
+
+_jobs_ejecutor = None
+_jobs_ejecutor_pid = None
+# Identidad del worker (host:pid:azar, por si el pid se reutiliza) y trabajos suyos sin terminar
+_jobs_worker = None
+_jobs_activos = 0
+_jobs_latido_hilo = None
+
+
+def obtener_ejecutor_jobs() -> ThreadPoolExecutor:
+    """Hilos para las importaciones, uno por proceso (como obtener_ejecutor)."""
+    global _jobs_ejecutor, _jobs_ejecutor_pid
+    pid = os.getpid()
+    if _jobs_ejecutor is None or _jobs_ejecutor_pid != pid:
+        with _ejecutor_lock:
+            if _jobs_ejecutor is None or _jobs_ejecutor_pid != pid:
+                _jobs_ejecutor = ThreadPoolExecutor(max_workers=HOLD_JOBS_HILOS, thread_name_prefix="hold-job")
+                _jobs_ejecutor_pid = pid
+    return _jobs_ejecutor
+
+
+def _hold_jobs_worker() -> str:
+    global _jobs_worker
+    prefijo = f"{socket.gethostname()}:{os.getpid()}:"
+    if _jobs_worker is None or not _jobs_worker.startswith(prefijo):
+        _jobs_worker = prefijo + secrets.token_hex(4)
+    return _jobs_worker
+
+
+def _hold_jobs_latir():
+    """
+    Hilo de latido del worker: cada HOLD_JOBS_LATIDO_SEG renueva el latido de sus trabajos y cierra
+    como error los de otros workers que dejaron de latir. Termina cuando el worker no tiene trabajos.
+    """
+    global _jobs_latido_hilo
+    worker = _hold_jobs_worker()
+    while True:
+        time.sleep(HOLD_JOBS_LATIDO_SEG)
+        with _ejecutor_lock:
+            if _jobs_activos == 0:
+                _jobs_latido_hilo = None
+                return
+        with app.app_context():
+            exec_sql("""
+                UPDATE hold_jobs SET latido = now()
+                 WHERE worker = %s AND estado IN ('pendiente', 'en_curso')
+            """, (worker,))
+            exec_sql("""
+                UPDATE hold_jobs
+                   SET estado = 'error', resultado = '{"ok": false, "msg": "La importación se interrumpió"}', actualizado = now()
+                 WHERE estado IN ('pendiente', 'en_curso') AND COALESCE(latido, actualizado) < now() - %s * interval '1 second'
+            """, (HOLD_JOBS_TIMEOUT,))
+
+
+def _hold_jobs_contar(delta: int):
+    """Suma o resta trabajos activos del worker; con alguno activo se asegura el hilo de latido."""
+    global _jobs_activos, _jobs_latido_hilo
+    with _ejecutor_lock:
+        _jobs_activos += delta
+        vivo = _jobs_latido_hilo is not None and _jobs_latido_hilo.is_alive()
+        if _jobs_activos > 0 and not vivo:
+            _jobs_latido_hilo = threading.Thread(target=_hold_jobs_latir, name="hold-job-latido", daemon=True)
+            _jobs_latido_hilo.start()
+
+
+def _hold_job_avance(job_id: str):
+    """Devuelve progreso(fase, filas) para el trabajo; escribe a lo más cada HOLD_JOBS_AVANCE_SEG."""
+    ultimo = {"t": 0.0, "fase": None}
+
+    def progreso(fase, filas):
+        ahora = time.monotonic()
+        if fase == ultimo["fase"] and ahora - ultimo["t"] < HOLD_JOBS_AVANCE_SEG:
+            return
+        ultimo.update(t=ahora, fase=fase)
+        exec_sql("UPDATE hold_jobs SET fase = %s, filas = %s, actualizado = now() WHERE id = %s AND estado <> 'error'",
+                 (fase, filas, job_id))
+
+    return progreso
+
+
+def _hold_job_correr(job_id: str, funcion, args: tuple):
+    # Las actualizaciones no tocan un trabajo ya cerrado como interrumpido: no se "revive"
+    try:
+        with app.app_context():
+            _, tomado = exec_sql_returning("""
+                UPDATE hold_jobs SET estado = 'en_curso', latido = now(), actualizado = now()
+                 WHERE id = %s AND estado <> 'error'
+                RETURNING id
+            """, (job_id,))
+            if not tomado:
+                return
+            try:
+                res, _ = funcion(*args, progreso=_hold_job_avance(job_id))
+            except Exception as e:
+                print("job error:", job_id, e)
+                res = {'ok': False, 'msg': 'Error en la importación'}
+            filas = res.get('total', res.get('inserted', 0) + res.get('skipped', 0)) if res.get('ok') else None
+            exec_sql("""
+                UPDATE hold_jobs
+                   SET estado = %s, resultado = %s, filas = COALESCE(%s, filas), actualizado = now()
+                 WHERE id = %s AND estado <> 'error'
+            """, ('ok' if res.get('ok') else 'error', psycopg2.extras.Json(res, dumps=app.json.dumps), filas, job_id))
+    finally:
+        _hold_jobs_contar(-1)
+
+
+def hold_job_lanzar(tipo: str, archivo: str, funcion, *args) -> str:
+    """
+    Registra el trabajo en hold_jobs y lo encola. funcion(*args, progreso=...) debe devolver
+    (respuesta, status) como hold_preview / hold_insertar. Devuelve el id del trabajo.
+    """
+    job_id = secrets.token_urlsafe(12)
+    exec_sql("DELETE FROM hold_jobs WHERE creado < now() - %s * interval '1 day'", (HOLD_JOBS_RETENCION_DIAS,))
+    if not exec_sql("INSERT INTO hold_jobs (id, tipo, usuario, archivo, worker, latido) VALUES (%s, %s, %s, %s, %s, now())",
+                    (job_id, tipo, session.get('usuario'), archivo, _hold_jobs_worker())):
+        raise RuntimeError("No se pudo registrar el trabajo")
+    _hold_jobs_contar(1)
+    try:
+        obtener_ejecutor_jobs().submit(_hold_job_correr, job_id, funcion, args)
+    except Exception:
+        _hold_jobs_contar(-1)
+        raise
+    return job_id
+
+
+def _hold_preview_archivo(ruta: str, nombre: str, limite: int, forzar: bool = False, progreso=None) -> tuple:
+    """hold_preview sobre el archivo guardado por /api/hold/jobs; lo borra al terminar."""
+    try:
+        with open(ruta, 'rb') as f:
+            return hold_preview(f, nombre, progreso, limite, forzar)
+    finally:
+        os.remove(ruta)
+
+
+def _hold_insertar_lote(lote: str, progreso=None) -> tuple:
+    """hold_insertar sobre un lote ya reservado con hold_staging_reclamar."""
+    return hold_insertar(hold_staging_leer(lote), lote, progreso)
+
+
+@app.route('/api/hold/jobs', methods=['POST'])
+def api_hold_jobs_crear():
+    """
+    Encola una importación y responde enseguida con el id del trabajo (202).
+    - multipart con 'file' (y 'forzar' opcional): lee el Excel (como /api/hold/preview).
+    - JSON {token}: inserta el lote (como /api/hold/insert; solo Admin).
+    """
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+
+    f = request.files.get('file')
+    lote = None
+    ruta = None
+    try:
+        if f:
+            filename = (f.filename or '').lower()
+            if not (filename.endswith('.xlsx') or filename.endswith('.xls')):
+                return jsonify({'ok': False, 'msg': 'Formato no admitido. Usa .xlsx o .xls'}), 400
+            os.makedirs(HOLD_STAGING_DIR, exist_ok=True)
+            # Se guarda en disco: el archivo del request se cierra al responder
+            ruta = os.path.join(HOLD_STAGING_DIR, f"subida_{secrets.token_urlsafe(12)}{os.path.splitext(filename)[1]}")
+            f.save(ruta)
+            _, limit = _hold_pagina_args()
+            job_id = hold_job_lanzar('preview', f.filename, _hold_preview_archivo, ruta, f.filename, limit,
+                                     _hold_forzar())
+        else:
+            if session.get('rol') != 'Admin':
+                return jsonify({'ok': False, 'msg': 'Solo Admin puede insertar'}), 403
+            data = request.get_json(silent=True) or {}
+            lote = hold_staging_reclamar(data.get('token'))
+            if not lote:
+                return jsonify({'ok': False, 'msg': 'La carga expiró o ya se insertó; vuelve a subir el archivo'}), 410
+            job_id = hold_job_lanzar('insertar', None, _hold_insertar_lote, lote)
+    except Exception as e:
+        print("job error:", e)
+        if lote:
+            hold_staging_devolver(lote)
+        if ruta:
+            # El trabajo no llegó a encolarse: nadie más va a leer ni borrar la subida
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+        return jsonify({'ok': False, 'msg': 'No se pudo iniciar la importación'}), 500
+
+    return jsonify({'ok': True, 'job': job_id, 'estado_url': url_for('api_hold_jobs_estado', job_id=job_id)}), 202
+
+
+@app.route('/api/hold/jobs/<job_id>', methods=['GET'])
+def api_hold_jobs_estado(job_id):
+    """Estado de un trabajo: estado (pendiente, en_curso, ok, error), fase (parsing, validating, loading), filas y resultado."""
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autenticado'}), 401
+
+    job = query_uno("""
+        SELECT id, tipo, usuario, archivo, estado, fase, filas, resultado, creado, actualizado,
+               estado IN ('pendiente', 'en_curso')
+                 AND COALESCE(latido, actualizado) < now() - %s * interval '1 second' AS interrumpido
+          FROM hold_jobs WHERE id = %s
+    """, (HOLD_JOBS_TIMEOUT, job_id))
+    if not job or (job['usuario'] != session.get('usuario') and session.get('rol') != 'Admin'):
+        return jsonify({'ok': False, 'msg': 'Trabajo no encontrado'}), 404
+    # Su worker dejó de latir (se reinició): se informa como error aunque nadie lo haya cerrado aún
+    if job.pop('interrumpido'):
+        job.update(estado='error', resultado={'ok': False, 'msg': 'La importación se interrumpió'})
+    return jsonify_comprimido({'ok': True, **job, 'terminado': job['estado'] in ('ok', 'error')})
 
 
 
@@ -1148,6 +3206,12 @@ MESES_NOMBRE = [
     "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"
 ]
 
+# Tablas de las que depende el contexto de hold (ETag de /api/hold/data). La clave de hold_cache
+# usa las mismas con más detalle: la versión por mes de datos_diario y tipo_cambio (cada importación
+# escribe en datos y en datos_diario) y los selectores que salen de datos_periodos.
+HOLD_TABLAS = ("datos", "datos_periodos", "maquinas", "modelos", "tipo_cambio")
+
+
 @app.route('/hold')
 def hold():
     if not is_logged_in():
@@ -1164,6 +3228,8 @@ def hold():
 
 
 @app.route('/api/hold/data', methods=['GET'])
+# Mismas tablas que la clave de hold_cache: un ETag nuevo nunca se responde con un contexto anterior
+@cache_http(*HOLD_TABLAS, diario=True)
 def hold_data():
     if not is_logged_in():
         return jsonify({'ok': False, 'msg': 'No autorizado'}), 401
@@ -1187,7 +3253,7 @@ def hold_data():
             return float(x)
         return x
 
-    return jsonify({'ok': True, 'data': norm(ctx)})
+    return jsonify_comprimido({'ok': True, 'data': norm(ctx)})
 
 
 
@@ -1196,10 +3262,93 @@ def hold_data():
 # =========================
 # Helper: contexto para HOLD (JSON + Template)
 # =========================
+# Caché del contexto de hold por (día de hoy, modelo, selectores, versiones de maquinas y modelos y
+# versión del mes elegido en datos_diario y tipo_cambio): un cambio en un mes no invalida los demás
+HOLD_CACHE_MAX = int(os.environ.get("HOLD_CACHE_MAX", "128"))
+HOLD_CACHE_TTL = float(os.environ.get("HOLD_CACHE_TTL", "300"))
+hold_cache = CacheLRU("hold", HOLD_CACHE_MAX, HOLD_CACHE_TTL)
+
+
+def invalidar_hold_meses(meses, selectores: bool = True):
+    """
+    Invalida el contexto de hold cacheado para los (anio, mes) afectados por un cambio.
+    Con selectores=True (cambios en datos) también descarta las entradas cuyos
+    selectores de año/mes dejarían de estar completos.
+    No hace falta para la corrección: la versión del mes en la clave ya deja de servirlas en todos
+    los workers. Solo libera enseguida la memoria del worker que hizo el cambio.
+    """
+    meses = {(int(a), int(m)) for a, m in meses}
+    if not meses:
+        return 0
+
+    def afectado(_clave, ctx):
+        if (ctx["anio_sel"], ctx["mes_sel"]) in meses:
+            return True
+        if not selectores:
+            return False
+        for a, m in meses:
+            if a not in ctx["anios_disponibles"]:
+                return True
+            if a == ctx["anio_sel"] and m not in {o["num"] for o in ctx["meses_opciones"]}:
+                return True
+        return False
+
+    return hold_cache.invalidar(afectado)
+
+
 def get_hold_context(anio=None, mes=None, dia=None, modelo_id=None):
     if not is_logged_in():
         return {}
 
+    selectores = _hold_selectores(anio, mes, dia)
+    anio_sel, mes_sel = selectores[:2]
+    versiones = versiones_datos()
+    clave = (date.today(), modelo_id, selectores, versiones.get("maquinas"), versiones.get("modelos"),
+             version_mes("datos_diario", anio_sel, mes_sel), version_mes("tipo_cambio", anio_sel, mes_sel))
+    ctx = hold_cache.obtener(clave)
+    if ctx is None:
+        ctx = _calcular_hold_context(selectores, modelo_id)
+        hold_cache.guardar(clave, ctx)
+    return {
+        **ctx,
+        "rol": session.get("rol"),
+        "usuario": session.get("usuario"),
+    }
+
+
+def _hold_kpis_bloque(ingreso, win, maquinas_activas, dias_periodo, dias_pos, tc_val):
+    """KPIs del bloque filtrable de hold (promedios netos en dólares y retención) a partir de sus totales."""
+    avg_net_in = net_in_diario = avg_net_win = net_win_diario = retencion = 0.0
+    if tc_val and maquinas_activas and dias_periodo:
+        avg_net_in  = _safe_div(_safe_div(ingreso, maquinas_activas), tc_val)
+        avg_net_in  = _safe_div(avg_net_in, dias_periodo)
+        avg_net_win = _safe_div(_safe_div(win, maquinas_activas), tc_val)
+        avg_net_win = _safe_div(avg_net_win, dias_periodo)
+
+    if tc_val and maquinas_activas and dias_pos:
+        net_in_diario  = _safe_div(_safe_div(ingreso, dias_pos), tc_val)
+        net_in_diario  = _safe_div(net_in_diario, maquinas_activas)
+        net_win_diario = _safe_div(_safe_div(win, dias_pos), tc_val)
+        net_win_diario = _safe_div(net_win_diario, maquinas_activas)
+
+    if ingreso:
+        retencion = _safe_div(win, ingreso) * 100.0
+
+    return {
+        "avg_net_in": avg_net_in,
+        "avg_net_win": avg_net_win,
+        "net_in_diario": net_in_diario,
+        "net_win_diario": net_win_diario,
+        "retencion": retencion,
+    }
+
+
+def _hold_selectores(anio=None, mes=None, dia=None) -> tuple:
+    """
+    Año, mes y día efectivos de hold y las opciones de sus selectores, desde el calendario de días
+    con datos (datos_periodos, en memoria por versión). Sin consultas si el catálogo está al día.
+    Devuelve (anio_sel, mes_sel, dia_sel, anios_disponibles, meses_disponibles, dias_disponibles).
+    """
     hoy = date.today()
     anio_hoy = hoy.year
     mes_hoy_num = hoy.month
@@ -1208,112 +3357,152 @@ def get_hold_context(anio=None, mes=None, dia=None, modelo_id=None):
     anio_sel   = anio or anio_hoy
     mes_sel    = mes  or mes_hoy_num
     dia_sel    = dia
-    modelo_sel = modelo_id
+    # Mes/día fuera de rango: no hay consultas posibles para ellos, se usan los valores por defecto
+    if not 1 <= mes_sel <= 12:
+        mes_sel = mes_hoy_num
+    if dia_sel is not None and not 1 <= dia_sel <= 31:
+        dia_sel = None
 
-    base_cte = """
-      WITH dts AS (
-        SELECT d.*,
-               to_timestamp(d.jornada, 'DD/MM/YYYY HH24:MI') AS tstamp
-        FROM datos d
-      )
-    """
+    periodos = catalogos("periodos")[0]
 
     # Años disponibles
-    anios_rows = query_todos(base_cte + """
-        SELECT DISTINCT EXTRACT(YEAR FROM tstamp)::int AS anio
-        FROM dts
-        WHERE tstamp IS NOT NULL
-        ORDER BY 1 DESC
-    """)
-    anios_disponibles = [r['anio'] for r in anios_rows]
+    anios_disponibles = sorted({p['anio'] for p in periodos}, reverse=True)
     if anio_hoy not in anios_disponibles:
         anios_disponibles = [anio_hoy] + anios_disponibles
 
     # Meses disponibles
-    meses_rows = query_todos(base_cte + """
-        SELECT DISTINCT EXTRACT(MONTH FROM tstamp)::int AS mes
-        FROM dts
-        WHERE tstamp IS NOT NULL
-          AND EXTRACT(YEAR FROM tstamp)::int = %s
-        ORDER BY 1
-    """, (anio_sel,))
-    meses_disponibles = [r['mes'] for r in meses_rows]
+    meses_disponibles = sorted({p['mes'] for p in periodos if p['anio'] == anio_sel})
     if anio_sel == anio_hoy and mes_hoy_num not in meses_disponibles:
         meses_disponibles = [mes_hoy_num] + meses_disponibles
     if meses_disponibles and mes_sel not in meses_disponibles:
         mes_sel = mes_hoy_num if mes_hoy_num in meses_disponibles else meses_disponibles[0]
 
     # Días disponibles
-    dias_rows = query_todos(base_cte + """
-        SELECT DISTINCT EXTRACT(DAY FROM tstamp)::int AS dia
-        FROM dts
-        WHERE tstamp IS NOT NULL
-          AND EXTRACT(YEAR FROM tstamp)::int = %s
-          AND EXTRACT(MONTH FROM tstamp)::int = %s
-        ORDER BY 1
-    """, (anio_sel, mes_sel))
-    dias_disponibles = [r['dia'] for r in dias_rows]
+    dias_disponibles = [p['dia'] for p in periodos if p['anio'] == anio_sel and p['mes'] == mes_sel]
     if dia_sel and dias_disponibles and dia_sel not in dias_disponibles:
         dia_sel = None  # "Todos"
 
+    return anio_sel, mes_sel, dia_sel, tuple(anios_disponibles), tuple(meses_disponibles), tuple(dias_disponibles)
+
+
+def _calcular_hold_context(selectores: tuple, modelo_id=None):
+    """Calcula el contexto de hold para los selectores de _hold_selectores (sin datos de sesión, para poder cachearlo)."""
+    hoy = date.today()
+    anio_sel, mes_sel, dia_sel, anios_disponibles, meses_disponibles, dias_disponibles = selectores
+    anios_disponibles = list(anios_disponibles)
+    meses_disponibles = list(meses_disponibles)
+    dias_disponibles = list(dias_disponibles)
+    modelo_sel = modelo_id
+
     # Tipo de cambio (tu DB guarda el mes como texto)
+    def consulta_tipo_cambio(mes_sel):
+        return ("uno", """
+            SELECT id_cambio, anio, mes, valor_cambio
+            FROM tipo_cambio
+            WHERE anio = %s AND mes = %s
+            LIMIT 1
+        """, (anio_sel, MESES_NOMBRE[mes_sel - 1]))
+
+    # Todos los KPIs (globales y filtrables) y sidebar en una sola
+    # consulta sobre el resumen por máquina/día (datos_diario), no sobre las filas crudas.
+    def consulta_kpis(mes_sel, dia_sel):
+        where_dia = ""
+        params_dia = []
+        if dia_sel:
+            where_dia = " AND EXTRACT(DAY FROM dia)::int = %s "
+            params_dia = [dia_sel]
+
+        # Filtro Día? + Modelo? sobre el JOIN normalizado m.numero ↔ d.maquina
+        where_join = where_dia
+        params_join = list(params_dia)
+        if modelo_sel:
+            where_join += " AND id_modelo = %s "
+            params_join.append(modelo_sel)
+
+        sql = f"""
+          WITH diario AS (
+            SELECT maquina, maquina_norm AS clave, dia, total_in, win, jugado_pos
+            FROM datos_diario
+            WHERE dia >= %s AND dia < %s
+          ),
+          maq AS (
+            SELECT id_maquina, id_modelo, numero_norm AS clave
+            FROM maquinas
+          ),
+          dj AS (
+            SELECT x.*, m.id_maquina, m.id_modelo
+            FROM diario x
+            JOIN maq m ON m.clave = x.clave
+          )
+          SELECT
+            -- ====== 1) KPIs GLOBALES (solo Año/Mes) ======
+            (SELECT COALESCE(SUM(total_in),0) FROM diario) AS ingreso_total,
+            (SELECT COALESCE(SUM(win),0) FROM diario) AS win_total,
+            (SELECT COUNT(DISTINCT dia) FROM diario) AS dias_periodo,
+            (SELECT COUNT(DISTINCT maquina) FILTER (WHERE jugado_pos) FROM diario) AS maquinas_distintas_kpi,
+            (SELECT COUNT(DISTINCT clave) FILTER (WHERE jugado_pos) FROM diario) AS maquinas_distintas,
+            (SELECT COALESCE(AVG(cnt), 0) FROM (
+               SELECT maquina, COUNT(DISTINCT dia) AS cnt
+               FROM dj WHERE jugado_pos
+               GROUP BY maquina
+             ) sub) AS prom_dias_jugado_pos_t,
+            -- ====== 2) BLOQUE FILTRABLE (Día?, Modelo?) ======
+            (SELECT COALESCE(AVG(cnt), 0) FROM (
+               SELECT maquina, COUNT(DISTINCT dia) AS cnt
+               FROM diario WHERE jugado_pos {where_dia}
+               GROUP BY maquina
+             ) sub) AS prom_dias_jugado_pos,
+            (SELECT COUNT(DISTINCT id_maquina) FROM dj WHERE jugado_pos {where_join}) AS maquinas_activas_hold,
+            (SELECT COALESCE(SUM(total_in),0) FROM dj WHERE TRUE {where_join}) AS ingreso_total_m,
+            (SELECT COALESCE(SUM(win),0) FROM dj WHERE TRUE {where_join}) AS win_total_m,
+            (SELECT COALESCE(AVG(cnt), 0) FROM (
+               SELECT maquina, COUNT(DISTINCT dia) AS cnt
+               FROM dj WHERE jugado_pos {where_join}
+               GROUP BY maquina
+             ) sub) AS dias_periodo_pos_m,
+            -- Sidebar de modelos (A/M[/D])
+            (SELECT COALESCE(json_agg(s), '[]'::json) FROM (
+               SELECT
+                   mo.id_modelo,
+                   mo.name_modelo,
+                   COUNT(DISTINCT CASE WHEN x.jugado_pos THEN m.id_maquina END) AS cant_maquinas_periodo
+               FROM modelos mo
+               LEFT JOIN maq m
+                      ON m.id_modelo = mo.id_modelo
+               LEFT JOIN diario x
+                      ON x.clave = m.clave
+                     {where_dia}
+               GROUP BY mo.id_modelo, mo.name_modelo
+               HAVING COUNT(CASE WHEN x.jugado_pos THEN m.id_maquina END) > 0
+               ORDER BY mo.name_modelo NULLS LAST
+             ) s) AS modelos_sidebar
+        """
+        params = (
+            list(_rango_mes(anio_sel, mes_sel))
+            + params_dia
+            + params_join * 4
+            + params_dia
+        )
+        return ("uno", sql, tuple(params))
+
+    # Con mes/día ya corregidos, tipo de cambio y KPIs se consultan una sola vez y en paralelo
+    res = query_paralelo({
+        "tipo_cambio": consulta_tipo_cambio(mes_sel),
+        "kpis": consulta_kpis(mes_sel, dia_sel),
+    })
+    kpis = res["kpis"]
+
     mes_sel_nombre = MESES_NOMBRE[mes_sel - 1]
-    tipo_cambio_actual = query_uno("""
-        SELECT id_cambio, anio, mes, valor_cambio
-        FROM tipo_cambio
-        WHERE anio = %s AND mes = %s
-        LIMIT 1
-    """, (anio_sel, mes_sel_nombre)) or {
+    tipo_cambio_actual = res["tipo_cambio"] or {
         "anio": anio_sel, "mes": mes_sel_nombre, "valor_cambio": "-"
     }
     tc_val = _to_float(tipo_cambio_actual.get('valor_cambio')) if isinstance(tipo_cambio_actual, dict) else None
 
-    # ====== 1) KPIs GLOBALES (solo Año/Mes) ======
-    where_kpi = (
-        " WHERE tstamp IS NOT NULL "
-        " AND EXTRACT(YEAR FROM tstamp)::int = %s "
-        " AND EXTRACT(MONTH FROM tstamp)::int = %s "
-    )
-    params_kpi = [anio_sel, mes_sel]
-
-    ingreso_total = _to_float(query_valor(base_cte + f"""
-        SELECT COALESCE(SUM(total_in),0)
-        FROM dts
-        {where_kpi}
-    """, tuple(params_kpi))) or 0.0
-
-    win_total = _to_float(query_valor(base_cte + f"""
-        SELECT COALESCE(SUM(total_in - total_out),0)
-        FROM dts
-        {where_kpi}
-    """, tuple(params_kpi))) or 0.0
-
-    dias_periodo_t = query_valor(base_cte + f"""
-        SELECT COUNT(DISTINCT DATE(tstamp))
-        FROM dts
-        {where_kpi}
-    """, tuple(params_kpi)) or 0
-
-    maquinas_distintas_kpi = query_valor(base_cte + f"""
-        SELECT COUNT(DISTINCT maquina)
-        FROM dts
-        {where_kpi} AND COALESCE(jugado,0) > 0
-    """, tuple(params_kpi)) or 0
-
-    prom_dias_jugado_pos_t = query_valor(base_cte + f"""
-        SELECT COALESCE(AVG(sub.cnt), 0)
-        FROM (
-        SELECT d.maquina, COUNT(DISTINCT DATE(d.tstamp)) AS cnt
-        FROM dts d
-        JOIN maquinas m 
-            ON regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-            = regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        {where_kpi} AND COALESCE(d.jugado,0) > 0
-        GROUP BY d.maquina
-        ) sub
-    """, params_kpi) or 0.0
-
-    prom_dias_jugado_pos_t = _to_float(prom_dias_jugado_pos_t) or 0.0
+    ingreso_total = _to_float(kpis["ingreso_total"]) or 0.0
+    win_total = _to_float(kpis["win_total"]) or 0.0
+    dias_periodo_t = kpis["dias_periodo"] or 0
+    maquinas_distintas_kpi = kpis["maquinas_distintas_kpi"] or 0
+    prom_dias_jugado_pos_t = _to_float(kpis["prom_dias_jugado_pos_t"] or 0.0) or 0.0
 
     avg_net_in = avg_net_win = net_in_diario = net_win_diario = retencion = 0.0
     if tc_val and dias_periodo_t and maquinas_distintas_kpi:
@@ -1331,138 +3520,23 @@ def get_hold_context(anio=None, mes=None, dia=None, modelo_id=None):
     if ingreso_total:
         retencion = _safe_div(win_total, ingreso_total) * 100.0
 
-    # ====== 2) BLOQUE FILTRABLE (Año, Mes, Día?, Modelo?) ======
-    # where_mes_anio: SOLO A/M (para días del período)
-    where_mes_anio = where_kpi
-    params_mes_anio = list(params_kpi)
-
-    # where_periodo: A/M + (opcional) Día
-    where_periodo = where_kpi
-    params_periodo = list(params_kpi)
-    if dia_sel:
-        where_periodo += " AND EXTRACT(DAY FROM tstamp)::int = %s "
-        params_periodo.append(dia_sel)
-
-    # where_join: (periodo) + (opcional) modelo — JOIN normalizado m.numero ↔ d.maquina
-    where_join = where_periodo
-    params_join = list(params_periodo)
-    if modelo_sel:
-        where_join += " AND m.id_modelo = %s "
-        params_join.append(modelo_sel)
-    params_join = tuple(params_join)
-
-    prom_dias_jugado_pos = query_valor(base_cte + f"""
-        SELECT COALESCE(AVG(sub.cnt), 0)
-        FROM (
-          SELECT maquina, COUNT(DISTINCT DATE(tstamp)) AS cnt
-          FROM dts
-          {where_periodo} AND COALESCE(jugado,0) > 0
-          GROUP BY maquina
-        ) sub
-    """, tuple(params_periodo)) or 0.0
-    prom_dias_jugado_pos = _to_float(prom_dias_jugado_pos) or 0.0
+    prom_dias_jugado_pos = _to_float(kpis["prom_dias_jugado_pos"] or 0.0) or 0.0
+    maquinas_distintas = kpis["maquinas_distintas"] or 0
+    maquinas_activas_hold = kpis["maquinas_activas_hold"] or 0
+    dias_periodo = kpis["dias_periodo"] or 0
+    ingreso_total_m = _to_float(kpis["ingreso_total_m"]) or 0.0
+    win_total_m = _to_float(kpis["win_total_m"]) or 0.0
+    dias_periodo_pos_m = kpis["dias_periodo_pos_m"] or 0.0
 
-    # Máquinas distintas (A/M; jugado>0) usando clave normalizada en dts
-    maquinas_distintas = query_valor(base_cte + f"""
-        SELECT COUNT(
-            DISTINCT regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        )
-        FROM dts d
-        {where_kpi} AND COALESCE(d.jugado,0) > 0
-    """, tuple(params_kpi)) or 0
-
-    # Máquinas activas (A/M[/D][/Modelo]; jugado>0) con JOIN normalizado
-    maquinas_activas_hold = query_valor(base_cte + f"""
-        SELECT COUNT(DISTINCT m.id_maquina)
-        FROM dts d
-        JOIN maquinas m 
-          ON regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-           = regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        {where_join} AND COALESCE(d.jugado,0) > 0
-    """, params_join) or 0
-
-    # Días del período (solo A/M)
-    dias_periodo = query_valor(base_cte + f"""
-        SELECT COUNT(DISTINCT DATE(tstamp))
-        FROM dts
-        {where_mes_anio}
-    """, tuple(params_mes_anio)) or 0
-
-    # Totales (IN y WIN) bajo filtros — JOIN normalizado
-    ingreso_total_m = _to_float(query_valor(base_cte + f"""
-        SELECT COALESCE(SUM(d.total_in),0)
-        FROM dts d
-        JOIN maquinas m 
-          ON regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-           = regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        {where_join}
-    """, params_join)) or 0.0
-
-    win_total_m = _to_float(query_valor(base_cte + f"""
-        SELECT COALESCE(SUM(d.total_in - d.total_out),0)
-        FROM dts d
-        JOIN maquinas m 
-          ON regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-           = regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        {where_join}
-    """, params_join)) or 0.0
-
-    # Días con juego (>0) bajo filtros (para *_diario_m)
-    dias_periodo_pos_m = query_valor(base_cte + f"""
-        SELECT COALESCE(AVG(sub.cnt), 0)
-        FROM (
-        SELECT d.maquina, COUNT(DISTINCT DATE(d.tstamp)) AS cnt
-        FROM dts d
-        JOIN maquinas m 
-            ON regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-            = regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-        {where_join} AND COALESCE(d.jugado,0) > 0
-        GROUP BY d.maquina
-        ) sub
-    """, params_join) or 0.0
-
-    avg_net_in_m = net_in_diario_m = avg_net_win_m = net_win_diario_m = retencion_m = 0.0
-    if tc_val and maquinas_activas_hold and dias_periodo:
-        avg_net_in_m  = _safe_div(_safe_div(ingreso_total_m, maquinas_activas_hold), tc_val)
-        avg_net_in_m  = _safe_div(avg_net_in_m, dias_periodo)
-        avg_net_win_m = _safe_div(_safe_div(win_total_m, maquinas_activas_hold), tc_val)
-        avg_net_win_m = _safe_div(avg_net_win_m, dias_periodo)
-
-    if tc_val and maquinas_activas_hold and dias_periodo_pos_m:
-        net_in_diario_m  = _safe_div(_safe_div(ingreso_total_m, dias_periodo_pos_m), tc_val)
-        net_in_diario_m  = _safe_div(net_in_diario_m, maquinas_activas_hold)
-        net_win_diario_m = _safe_div(_safe_div(win_total_m, dias_periodo_pos_m), tc_val)
-        net_win_diario_m = _safe_div(net_win_diario_m, maquinas_activas_hold)
-
-    if ingreso_total_m:
-        retencion_m = _safe_div(win_total_m, ingreso_total_m) * 100.0
-
-    # Sidebar de modelos
-    where_sidebar_on = """
-          AND EXTRACT(YEAR  FROM d.tstamp)::int = %s
-          AND EXTRACT(MONTH FROM d.tstamp)::int = %s
-    """
-    params_sidebar = [anio_sel, mes_sel]
-    if dia_sel:
-        where_sidebar_on += " AND EXTRACT(DAY FROM d.tstamp)::int = %s "
-        params_sidebar.append(dia_sel)
-
-    modelos_sidebar = query_todos(base_cte + f"""
-        SELECT 
-            mo.id_modelo,
-            mo.name_modelo,
-            COUNT(DISTINCT CASE WHEN COALESCE(d.jugado,0) > 0 THEN m.id_maquina END) AS cant_maquinas_periodo
-        FROM modelos mo
-        LEFT JOIN maquinas m 
-               ON m.id_modelo = mo.id_modelo
-        LEFT JOIN dts d 
-               ON regexp_replace(btrim(lower(d.maquina::text)),'[^0-9a-z]+','','g')
-               =  regexp_replace(btrim(lower(m.numero::text)),'[^0-9a-z]+','','g')
-              {where_sidebar_on}
-        GROUP BY mo.id_modelo, mo.name_modelo
-        HAVING COUNT(CASE WHEN COALESCE(d.jugado,0) > 0 THEN m.id_maquina END) > 0
-        ORDER BY mo.name_modelo NULLS LAST
-    """, tuple(params_sidebar))
+    bloque = _hold_kpis_bloque(ingreso_total_m, win_total_m, maquinas_activas_hold,
+                               dias_periodo, dias_periodo_pos_m, tc_val)
+    avg_net_in_m = bloque["avg_net_in"]
+    avg_net_win_m = bloque["avg_net_win"]
+    net_in_diario_m = bloque["net_in_diario"]
+    net_win_diario_m = bloque["net_win_diario"]
+    retencion_m = bloque["retencion"]
+
+    modelos_sidebar = kpis["modelos_sidebar"]
 
     meses_opciones = [{"num": m, "nombre": MESES_NOMBRE[m-1]} for m in sorted(set(meses_disponibles))]
 
@@ -1508,12 +3582,311 @@ def get_hold_context(anio=None, mes=None, dia=None, modelo_id=None):
         "avg_net_win_m": avg_net_win_m,
         "net_win_diario_m": net_win_diario_m,
         "retencion_m": retencion_m,
-        "rol": session.get("rol"),
-        "usuario": session.get("usuario"),
     }
 
 
 
+
+# =========================
+# Matriz de KPIs de hold por modelo o proveedor
+# =========================
+# Bloque filtrable de /hold (IN, WIN, máquinas activas, días con juego) para todos los grupos a la vez,
+# sobre el resumen datos_diario del mes. Los días del período y el tipo de cambio son comunes a todos.
+SQL_HOLD_MATRIZ = """
+    WITH diario AS (
+        SELECT maquina, maquina_norm AS clave, dia, total_in, win, jugado_pos
+        FROM datos_diario
+        WHERE dia >= %(desde)s AND dia < %(hasta)s
+    ),
+    dj AS (
+        SELECT x.*, m.id_maquina, {columnas}
+        FROM diario x
+        JOIN maquinas m ON m.numero_norm = x.clave
+        LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo
+        LEFT JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor
+        WHERE TRUE {where_dia}
+    ),
+    grupos AS (
+        SELECT {grupo},
+               COALESCE(SUM(total_in), 0) AS ingreso_total,
+               COALESCE(SUM(win), 0) AS win_total,
+               COUNT(DISTINCT id_maquina) FILTER (WHERE jugado_pos) AS maquinas_activas
+        FROM dj
+        GROUP BY {grupo}
+    ),
+    -- Promedio por máquina de los días con juego, como dias_periodo_pos_m de /hold
+    dias AS (
+        SELECT {clave}, AVG(cnt) AS dias_periodo_pos
+        FROM (
+            SELECT {clave}, maquina, COUNT(DISTINCT dia) AS cnt
+            FROM dj WHERE jugado_pos
+            GROUP BY {clave}, maquina
+        ) sub
+        GROUP BY {clave}
+    )
+    SELECT g.*,
+           COALESCE(d.dias_periodo_pos, 0) AS dias_periodo_pos,
+           (SELECT COUNT(DISTINCT dia) FROM diario) AS dias_periodo,
+           (SELECT valor_cambio FROM tipo_cambio WHERE anio = %(anio)s AND mes = %(mes)s LIMIT 1) AS valor_cambio
+    FROM grupos g
+    LEFT JOIN dias d ON d.{clave} IS NOT DISTINCT FROM g.{clave}
+    ORDER BY g.{orden} NULLS LAST
+"""
+
+# agrupar -> (columnas de dj, columnas del grupo, clave, orden)
+HOLD_MATRIZ_GRUPOS = {
+    "modelo": ("mo.id_modelo, mo.name_modelo, pr.name_proveedor", "id_modelo, name_modelo, name_proveedor", "id_modelo", "name_modelo"),
+    "proveedor": ("pr.id_proveedor, pr.name_proveedor", "id_proveedor, name_proveedor", "id_proveedor", "name_proveedor"),
+}
+
+
+@app.route('/api/hold/matriz', methods=['GET'])
+# Las mismas tablas que /api/hold/data (lee datos_diario) más proveedores para agrupar
+@cache_http(*HOLD_TABLAS, "proveedores", diario=True)
+def api_hold_matriz():
+    """
+    KPIs del bloque filtrable de /hold (IN, WIN, máquinas activas, avg_net_in/win, net_*_diario,
+    retención) de cada modelo o proveedor (?agrupar=) en el período ?anio=&mes=[&dia=], en una consulta.
+    """
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autorizado'}), 401
+
+    hoy = date.today()
+    anio = request.args.get('anio', hoy.year, type=int)
+    mes = request.args.get('mes', hoy.month, type=int)
+    dia = request.args.get('dia', type=int)
+    agrupar = request.args.get('agrupar', 'modelo')
+    if agrupar not in HOLD_MATRIZ_GRUPOS or not 1 <= mes <= 12:
+        return jsonify({'ok': False, 'msg': 'Parámetros inválidos: agrupar o mes'}), 400
+
+    columnas, grupo, clave, orden = HOLD_MATRIZ_GRUPOS[agrupar]
+    desde, hasta = _rango_mes(anio, mes)
+    filas = query_todos(SQL_HOLD_MATRIZ.format(
+        columnas=columnas, grupo=grupo, clave=clave, orden=orden,
+        where_dia=" AND EXTRACT(DAY FROM dia)::int = %(dia)s " if dia else "",
+    ), {"desde": desde, "hasta": hasta, "dia": dia, "anio": anio, "mes": MESES_NOMBRE[mes - 1]})
+
+    tc_val = _to_float(filas[0]["valor_cambio"]) if filas else None
+    dias_periodo = filas[0]["dias_periodo"] if filas else 0
+    items = []
+    for f in filas:
+        ingreso = _to_float(f["ingreso_total"]) or 0.0
+        win = _to_float(f["win_total"]) or 0.0
+        activas = f["maquinas_activas"] or 0
+        dias_pos = _to_float(f["dias_periodo_pos"]) or 0.0
+        item = {k: f[k] for k in grupo.split(", ")}
+        item.update({
+            "ingreso_total": ingreso,
+            "win_total": win,
+            "maquinas_activas": activas,
+            "dias_periodo_pos": dias_pos,
+            **_hold_kpis_bloque(ingreso, win, activas, dias_periodo, dias_pos, tc_val),
+        })
+        items.append(item)
+
+    return jsonify_comprimido({
+        'ok': True, 'anio': anio, 'mes': mes, 'dia': dia, 'agrupar': agrupar,
+        'tipo_cambio': tc_val, 'dias_periodo': dias_periodo,
+        'items': items,
+    })
+
+
+
+# =========================
+# Reporte de rentabilidad (WIN de hold - gastos)
+# =========================
+# Tipo de cambio por mes (la tabla guarda el mes por nombre), WIN por máquina desde el resumen
+# diario y gastos por máquina, todo del período [desde, hasta) y en una sola consulta.
+# El WIN y los gastos se convierten con el tipo de cambio de su mes.
+SQL_RENTABILIDAD = """
+    WITH tc AS (
+        SELECT DISTINCT ON (mes) mes, valor_cambio
+        FROM (
+            SELECT make_date(anio, array_position(%(meses)s::text[], initcap(btrim(mes))), 1) AS mes,
+                   NULLIF(valor_cambio, 0) AS valor_cambio, id_cambio
+            FROM tipo_cambio
+            WHERE array_position(%(meses)s::text[], initcap(btrim(mes))) IS NOT NULL
+        ) t
+        ORDER BY mes, id_cambio DESC
+    ),
+    win_mes AS (
+        SELECT maquina_norm, date_trunc('month', dia)::date AS mes, SUM(win) AS win
+        FROM datos_diario
+        WHERE dia >= %(desde)s AND dia < %(hasta)s
+        GROUP BY maquina_norm, date_trunc('month', dia)
+    ),
+    win AS (
+        SELECT m.id_maquina,
+               SUM(w.win) AS win,
+               SUM(w.win / tc.valor_cambio) AS win_usd,
+               bool_or(tc.valor_cambio IS NULL) AS sin_cambio
+        FROM win_mes w
+        JOIN maquinas m ON m.numero_norm = w.maquina_norm
+        LEFT JOIN tc ON tc.mes = w.mes
+        GROUP BY m.id_maquina
+    ),
+    gas_mes AS (
+        SELECT id_maquina, date_trunc('month', fecha)::date AS mes, SUM(monto) AS gastos
+        FROM gastos
+        WHERE fecha >= %(desde)s AND fecha < %(hasta)s
+        GROUP BY id_maquina, date_trunc('month', fecha)
+    ),
+    gas AS (
+        SELECT g.id_maquina,
+               SUM(g.gastos) AS gastos,
+               SUM(g.gastos / tc.valor_cambio) AS gastos_usd,
+               bool_or(tc.valor_cambio IS NULL) AS sin_cambio
+        FROM gas_mes g
+        LEFT JOIN tc ON tc.mes = g.mes
+        GROUP BY g.id_maquina
+    ),
+    base AS (
+        SELECT m.id_maquina, m.numero,
+               mo.id_modelo, mo.name_modelo,
+               pr.id_proveedor, pr.name_proveedor,
+               COALESCE(w.win, 0) AS win,
+               COALESCE(w.win_usd, 0) AS win_usd,
+               COALESCE(g.gastos, 0) AS gastos,
+               COALESCE(g.gastos_usd, 0) AS gastos_usd,
+               COALESCE(w.sin_cambio, false) OR COALESCE(g.sin_cambio, false) AS sin_cambio
+        FROM maquinas m
+        LEFT JOIN win w ON w.id_maquina = m.id_maquina
+        LEFT JOIN gas g ON g.id_maquina = m.id_maquina
+        LEFT JOIN modelos mo ON mo.id_modelo = m.id_modelo
+        LEFT JOIN proveedores pr ON pr.id_proveedor = mo.id_proveedor
+        WHERE w.id_maquina IS NOT NULL OR g.id_maquina IS NOT NULL
+    )
+    SELECT {columnas},
+           COUNT(*) AS maquinas,
+           SUM(win) AS win,
+           SUM(win_usd) AS win_usd,
+           SUM(gastos) AS gastos,
+           SUM(gastos_usd) AS gastos_usd,
+           SUM(win) - SUM(gastos) AS neto,
+           SUM(win_usd) - SUM(gastos_usd) AS neto_usd,
+           bool_or(sin_cambio) AS sin_tipo_cambio,
+           -- Totales de todos los grupos (antes del LIMIT)
+           COUNT(*) OVER () AS _grupos,
+           SUM(SUM(win)) OVER () AS _win,
+           SUM(SUM(win_usd)) OVER () AS _win_usd,
+           SUM(SUM(gastos)) OVER () AS _gastos,
+           SUM(SUM(gastos_usd)) OVER () AS _gastos_usd
+    FROM base
+    GROUP BY {columnas}
+    ORDER BY {orden} {sentido} NULLS LAST, {desempate}
+    LIMIT %(limite)s OFFSET %(offset)s
+"""
+
+# agrupar -> (columnas del grupo, columna para orden=nombre, desempate)
+RENTABILIDAD_GRUPOS = {
+    "maquina": ("id_maquina, numero, id_modelo, name_modelo, id_proveedor, name_proveedor", "numero", "id_maquina"),
+    "modelo": ("id_modelo, name_modelo, id_proveedor, name_proveedor", "name_modelo", "id_modelo"),
+    "proveedor": ("id_proveedor, name_proveedor", "name_proveedor", "id_proveedor"),
+}
+RENTABILIDAD_ORDEN = ("neto", "neto_usd", "win", "win_usd", "gastos", "gastos_usd", "maquinas", "nombre")
+RENTABILIDAD_LIMITE_MAX = 1000
+
+
+def _periodo_args():
+    """
+    [desde, hasta) del período pedido: ?desde=&hasta= (YYYY-MM-DD, inclusivos) o ?anio=&mes=
+    (mes 1..12 opcional). Sin parámetros, el mes en curso. None si el período no es válido.
+    """
+    desde = parse_date(request.args.get('desde'))
+    hasta = parse_date(request.args.get('hasta'))
+    if desde or hasta:
+        if not (desde and hasta) or desde > hasta:
+            return None
+        return desde, hasta + timedelta(days=1)
+    hoy = date.today()
+    anio = request.args.get('anio', hoy.year, type=int)
+    mes = request.args.get('mes', type=int)
+    if mes is None:
+        return _rango_anio(anio) if 'anio' in request.args else _rango_mes(hoy.year, hoy.month)
+    if not 1 <= mes <= 12:
+        return None
+    return _rango_mes(anio, mes)
+
+
+@app.route('/api/reportes/rentabilidad', methods=['GET'])
+# Lee datos_diario: reconstruir-diario no toca datos pero sí reescribe datos_periodos
+@cache_http("datos", "datos_periodos", "gastos", "maquinas", "modelos", "proveedores", "tipo_cambio")
+def api_reporte_rentabilidad():
+    """
+    WIN (total_in - total_out) menos gastos por máquina, modelo o proveedor (?agrupar=) en un período,
+    en colones y convertido a dólares con el tipo de cambio de cada mes. ?orden= y ?dir= ordenan
+    sobre los totales y ?page=/?limit= paginan los grupos.
+    """
+    if not is_logged_in():
+        return jsonify({'ok': False, 'msg': 'No autorizado'}), 401
+
+    periodo = _periodo_args()
+    if periodo is None:
+        return jsonify({'ok': False, 'msg': 'Período inválido: use desde y hasta (YYYY-MM-DD) o anio y mes'}), 400
+    agrupar = request.args.get('agrupar', 'maquina')
+    orden = request.args.get('orden', 'neto')
+    sentido = request.args.get('dir', 'desc').lower()
+    if agrupar not in RENTABILIDAD_GRUPOS or orden not in RENTABILIDAD_ORDEN or sentido not in ('asc', 'desc'):
+        return jsonify({'ok': False, 'msg': 'Parámetros inválidos: agrupar, orden o dir'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    limite = min(max(request.args.get('limit', 100, type=int), 1), RENTABILIDAD_LIMITE_MAX)
+
+    # Los grupos se ordenan por valores agregados, así que se pagina por desplazamiento
+    columnas, nombre, desempate = RENTABILIDAD_GRUPOS[agrupar]
+    sql = SQL_RENTABILIDAD.format(
+        columnas=columnas, orden=nombre if orden == "nombre" else orden,
+        sentido=sentido.upper(), desempate=desempate,
+    )
+    desde, hasta = periodo
+    filas = query_todos(sql, {
+        "meses": MESES_NOMBRE, "desde": desde, "hasta": hasta,
+        "limite": limite, "offset": (page - 1) * limite,
+    })
+
+    importes = ("win", "win_usd", "gastos", "gastos_usd", "neto", "neto_usd")
+    totales = dict.fromkeys(importes, 0.0)
+    grupos = 0
+    if filas:
+        f = filas[0]
+        grupos = f["_grupos"]
+        totales = {k: _to_float(f["_" + k]) or 0.0 for k in ("win", "win_usd", "gastos", "gastos_usd")}
+        totales["neto"] = totales["win"] - totales["gastos"]
+        totales["neto_usd"] = totales["win_usd"] - totales["gastos_usd"]
+    items = []
+    for f in filas:
+        item = {k: v for k, v in f.items() if not k.startswith("_")}
+        for k in importes:
+            item[k] = _to_float(item[k]) or 0.0
+        items.append(item)
+
+    return jsonify_comprimido({
+        'ok': True,
+        'desde': desde.isoformat(),
+        'hasta': (hasta - timedelta(days=1)).isoformat(),
+        'agrupar': agrupar, 'orden': orden, 'dir': sentido,
+        'page': page, 'limit': limite, 'pages': -(-grupos // limite), 'total': grupos,
+        'totales': totales,
+        'items': items,
+    })
+
+
+@app.route('/api/db/pool')
+def api_db_pool():
+    if not is_admin():
+        return jsonify(ok=False, msg="No autorizado"), 403
+    pool = obtener_pool()
+    if request.args.get('verificar'):
+        pool.verificar()
+    return jsonify(ok=True, pool=pool.stats())
+
+
+@app.route('/api/cache')
+def api_cache():
+    if not is_admin():
+        return jsonify(ok=False, msg="No autorizado"), 403
+    return jsonify(ok=True, caches={nombre: c.stats() for nombre, c in CACHES.items()})
+
+
 @app.route('/__routes__')
 def __routes__():
     return '<pre>' + '\n'.join(sorted(map(str, app.url_map.iter_rules()))) + '</pre>'